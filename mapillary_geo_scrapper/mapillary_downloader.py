@@ -101,18 +101,48 @@ MEDIUM_RECENT_SCORE = 0.9 # Score for medium recent images (increased)
 OLD_SCORE = 0.8           # Score for old images (increased)
 VERY_OLD_SCORE = 0.6      # Score for very old images (increased)
 
+# 🔍 DETECTION AND CAMERA SCORES (more permissive)
+NO_DETECTION_SCORE = 0.6          # Content scores of images without any detection (increased from 0.3)
+DETECTION_FAILED_SCORE = 0.7      # Content scores of every image when detection fails
+OTHER_CAMERA_QUALITY_SCORE = 0.8  # Quality of cameras not in PREFERRED_CAMERA_MAKES (increased from 0.5)
+
 # 📁 FILE PARAMETERS
 OUTPUT_FOLDER = "images"  # Output folder
 IMAGE_SIZE = "thumb_2048_url"  # Image size (thumb_256_url, thumb_1024_url, thumb_2048_url)
 
 # ============================================================================
 
-import requests
+import os
 import random
-from pathlib import Path
-from datetime import datetime, timedelta
 from config import MAPILLARY_TOKEN
 
+# The pooled Mapillary/Nominatim session, image filters and scoring engine come from the
+# question_gen_api package (pip install -r requirements.txt)
+from clients.mapillary_client import MapillarySession
+from shared.constants import MAPILLARY_IMAGES_URL, MAPILLARY_MAP_FEATURES_URL, MAPILLARY_MAX_PAGE_SIZE, NOMINATIM_SEARCH_URL
+from shared.image_filters import ImageBlacklist, ImageFilter, DEFAULT_BLACKLIST_PATH
+from shared.image_scoring import ImageCandidates, ImageScoringEngine, ScoringProfile
+
+mapillary_session = MapillarySession()
+
+# Scoring with the weights and thresholds configured above
+scoring_engine = ImageScoringEngine(ScoringProfile(
+    education_weight=EDUCATION_WEIGHT,
+    road_content_weight=ROAD_CONTENT_WEIGHT,
+    vehicle_content_weight=VEHICLE_CONTENT_WEIGHT,
+    vehicle_perspective_weight=VEHICLE_PERSPECTIVE_WEIGHT,
+    road_validation_weight=ROAD_VALIDATION_WEIGHT,
+    quality_weight=QUALITY_WEIGHT,
+    recency_weight=RECENCY_WEIGHT,
+    recency_days=(RECENT_THRESHOLD_DAYS, MEDIUM_RECENT_DAYS, OLD_THRESHOLD_DAYS),
+    recency_scores=(RECENT_SCORE, MEDIUM_RECENT_SCORE, OLD_SCORE, VERY_OLD_SCORE),
+    preferred_camera_makes=PREFERRED_CAMERA_MAKES,
+    other_camera_quality=OTHER_CAMERA_QUALITY_SCORE,
+    no_detection_score=NO_DETECTION_SCORE,
+    detection_failed_score=DETECTION_FAILED_SCORE,
+    max_top_candidates=MAX_TOP_CANDIDATES,
+))
+
 # Simplified mandatory features (reduced API calls)
 MANDATORY_FEATURES = [
     "construction--flat--road",
@@ -123,23 +153,18 @@ MANDATORY_FEATURES = [
     "warning--"
 ]
 
-# Blacklisted image identifiers (manually identified bad quality images)
-BLACKLISTED_IDENTIFIERS = [
-    "An8NShOw78k3pGN8EoVrZyqjBuqDR5YtvNKmTzOiVbYse527npF5OUXNPvvvjdJY",
-    "An-bISCPCtMS3qyX-gjXaqNuMKnGabShOGUh4WDUNTdli-eMlnHMGf9fXm3GHKZk",
-    "An9y5YkZKerXHQ8-RCbiRem1UHdS1NxZaOhsnAvLEaQ2o2gqezGFD1lG4CkOz9nC",
-    "An9pvLOmuHkTbUjw416wYc_w7I3IPPJfm0MebHRfJAvkz9yw9HbK-7u7Y5K_crLA",
-    "An_oaNqVVSkViiEFaOM7ItLCu4ASpFHpGFEGGD5oBs_OYfSZchUTkEVC6htzFGeF",
-    "An8qGFStJGOdWQzo6Xn1eipwLZLHBvtp17J7OAxHBJCoZeQON2cBk8Zn4vlBEEJ_",
-    "An8S8i2wDCVO4YERJ_IgOo_KbF8-hHkn6D038delY_fY1zj0kdwkNLadwAksbwrl",
-    "An-YvNugNSA0LSlppSKKa0W54j4sjSOT2ttWfiS9Qr68xxBH",
-    "An84ydomjfvWudlvXLDE-xBu3795H_SPXyMEqeTRAi8BbH6g",
-    "An9Y3v16CDPgv1SO9e-dFudqNzceKnqjMK6Z11rpPHO4htje"
-]
+# Blacklisted image identifiers (manually identified bad quality images) and excluded
+# cameras, compiled once. The blacklist lives in shared/image_blacklist.txt (or
+# IMAGE_BLACKLIST_PATH) and is reloaded when the file changes.
+image_filter = ImageFilter(
+    excluded_camera_types=EXCLUDED_CAMERA_TYPES,
+    excluded_camera_models=EXCLUDED_CAMERA_MODELS,
+    blacklist=ImageBlacklist(os.getenv("IMAGE_BLACKLIST_PATH") or DEFAULT_BLACKLIST_PATH),
+)
 
 def is_blacklisted(url):
     """Check if an image URL is blacklisted by matching its unique identifier."""
-    return any(identifier in url for identifier in BLACKLISTED_IDENTIFIERS)
+    return image_filter.is_blacklisted(url)
 
 def validate_road_context(coords):
     """
@@ -155,8 +180,8 @@ def validate_road_context(coords):
         # More comprehensive search including vehicles and people
         road_features_query = "object--street-light,object--traffic-light,marking--*,construction--barrier--*,object--vehicle--*,object--person"
         
-        response = requests.get(
-            "https://graph.mapillary.com/map_features",
+        response = mapillary_session.get(
+            MAPILLARY_MAP_FEATURES_URL,
             params={
                 "access_token": MAPILLARY_TOKEN,
                 "bbox": bbox,
@@ -196,11 +221,9 @@ def download_street_image(city="Paris", limit=DEFAULT_LIMIT):
 def get_city_coordinates(city):
     """Gets city coordinates via Nominatim geocoding service."""
     try:
-        response = requests.get(
-            "https://nominatim.openstreetmap.org/search",
+        response = mapillary_session.get(
+            NOMINATIM_SEARCH_URL,
             params={"q": city, "format": "json", "limit": 1},
-            headers={"User-Agent": "roadbuddy/1.0"},
-            timeout=5
         )
         
         data = response.json()
@@ -214,36 +237,29 @@ def get_city_coordinates(city):
 def get_educational_images(coords, limit):
     """Fetches Mapillary images optimized for driving education."""
     try:
-        margin = SEARCH_RADIUS_KM / 111.0
-        bbox = f"{coords['lon']-margin},{coords['lat']-margin},{coords['lon']+margin},{coords['lat']+margin}"
-        
-        # Single API call with essential fields
-        response = requests.get(
-            "https://graph.mapillary.com/images",
-            params={
-                "access_token": MAPILLARY_TOKEN,
-                "bbox": bbox,
-                "limit": limit * FETCH_MULTIPLIER,
-                "fields": "id,thumb_2048_url,captured_at,camera_type,is_pano,model,width,height",
-                "object_values": ",".join(MANDATORY_FEATURES)
-            },
-            timeout=10
-        )
-        
-        if response.status_code != 200:
-            return None
-            
-        all_images = response.json().get("data", [])
-        
-        # Apply essential quality filters
-        filtered_images = filter_quality_images(all_images)
-        
-        # Return top results after filtering
-        return filtered_images[:limit]
-        
+        images = list(harvest_educational_images(coords, limit))
+        return images or None
     except:
         return None
 
+def harvest_educational_images(coords, limit):
+    """
+    Yields Mapillary images that pass the quality filters, page by page, following
+    Mapillary's paging cursor only until `limit` images passed.
+    """
+    margin = SEARCH_RADIUS_KM / 111.0
+    bbox = f"{coords['lon']-margin},{coords['lat']-margin},{coords['lon']+margin},{coords['lat']+margin}"
+
+    # Pages sized for the expected filter loss, with essential fields
+    params = {
+        "access_token": MAPILLARY_TOKEN,
+        "bbox": bbox,
+        "limit": min(limit * FETCH_MULTIPLIER, MAPILLARY_MAX_PAGE_SIZE),
+        "fields": "id,thumb_2048_url,captured_at,camera_type,is_pano,model,width,height",
+        "object_values": ",".join(MANDATORY_FEATURES)
+    }
+    yield from mapillary_session.harvest(MAPILLARY_IMAGES_URL, params, accept=filter_quality_images, needed=limit)
+
 def get_image_url(image_data):
     """Returns the direct image URL."""
     try:
@@ -266,13 +282,11 @@ def filter_quality_images(images):
             continue
             
         # Skip 360° cameras
-        camera_type = img.get('camera_type', '').lower()
-        if any(excluded in camera_type for excluded in EXCLUDED_CAMERA_TYPES):
+        if image_filter.is_excluded_camera_type(img.get('camera_type', '')):
             continue
             
         # Skip known 360° camera models
-        model = img.get('model', '').strip().lower()
-        if any(excluded.lower() in model for excluded in EXCLUDED_CAMERA_MODELS):
+        if image_filter.is_excluded_camera_model(img.get('model', '').strip()):
             continue
             
         # Skip extreme aspect ratios
@@ -296,206 +310,67 @@ def filter_quality_cameras(images):
         make = img.get('make', '').strip()
         model = img.get('model', '').strip()
         
-        # Double-check: exclude known 360° cameras even if they passed previous filter
-        if any(excluded_model.lower() in model.lower() for excluded_model in EXCLUDED_CAMERA_MODELS):
-            # Only exclude if it's clearly a 360° camera
-            if '360' in model.lower() or 'theta' in model.lower() or 'insta360' in model.lower():
-                continue
+        # Double-check: exclude known 360° cameras even if they passed previous filter,
+        # but only if it's clearly a 360° camera
+        if image_filter.is_spherical_camera_model(model):
+            continue
             
-        # More permissive scoring - give good scores to most cameras
-        if any(preferred in make for preferred in PREFERRED_CAMERA_MAKES):
-            img['quality_score'] = 1.0
+        # Quality scores are given by the scoring engine, from the same preferred makes
+        if scoring_engine.profile.is_preferred_camera(make):
             quality_images.append(img)
         else:
-            img['quality_score'] = 0.8  # Increased from 0.5 to be more permissive
             other_images.append(img)
     
     # Return quality images first, then others
     return quality_images + other_images
 
-def get_images_with_detections(images, coords):
-    """Query for images that likely contain traffic signs, road infrastructure, and vehicle/driving content."""
+def get_images_with_detections(images, coords) -> ImageCandidates:
+    """Scores images by detected traffic signs, road infrastructure, and vehicle/driving content."""
+    candidates = scoring_engine.candidates(images)
+    scoring_engine.apply_detections(candidates, _get_detected_image_ids(coords))
+    return candidates
+
+def _fetch_detection_image_ids(bbox, object_types):
+    """Returns the ids of images in which Mapillary detected any of the given object types."""
+    response = mapillary_session.get(
+        MAPILLARY_MAP_FEATURES_URL,
+        params={
+            "access_token": MAPILLARY_TOKEN,
+            "bbox": bbox,
+            "limit": 500,
+            "object_values": ",".join(object_types),
+            "fields": "id,object_value,images"
+        },
+    )
+
+    image_ids = set()
+    if response.status_code == 200:
+        features = response.json().get("data", [])
+        for feature in features:
+            image_ids.update(feature.get('images', []))
+    return image_ids
+
+def _get_detected_image_ids(coords):
+    """Ids of the images with detections per scoring feature, None if detection failed."""
     try:
         # Create a search area for detection (configurable)
         margin = TRAFFIC_SIGN_RADIUS_KM / 111.0  # Convert km to degrees
         bbox = f"{coords['lon']-margin},{coords['lat']-margin},{coords['lon']+margin},{coords['lat']+margin}"
-        
-        # Query for traffic signs (configurable traffic sign types)
-        traffic_signs_query = ",".join(TRAFFIC_SIGN_TYPES)
-        
-        response = requests.get(
-            "https://graph.mapillary.com/map_features",
-            params={
-                "access_token": MAPILLARY_TOKEN,
-                "bbox": bbox,
-                "limit": 500,
-                "object_values": traffic_signs_query,
-                "fields": "id,object_value,images"
-            },
-            timeout=8
-        )
-        
-        # Collect image IDs with traffic signs
-        traffic_sign_image_ids = set()
-        if response.status_code == 200:
-            features = response.json().get("data", [])
-            for feature in features:
-                image_ids = feature.get('images', [])
-                traffic_sign_image_ids.update(image_ids)
-        
-        # Query for road infrastructure (separate request)
-        infrastructure_query = ",".join(ROAD_INFRASTRUCTURE_TYPES)
-        
-        infrastructure_response = requests.get(
-            "https://graph.mapillary.com/map_features",
-            params={
-                "access_token": MAPILLARY_TOKEN,
-                "bbox": bbox,
-                "limit": 500,
-                "object_values": infrastructure_query,
-                "fields": "id,object_value,images"
-            },
-            timeout=8
-        )
-        
-        # Collect image IDs with road infrastructure
-        infrastructure_image_ids = set()
-        if infrastructure_response.status_code == 200:
-            features = infrastructure_response.json().get("data", [])
-            for feature in features:
-                image_ids = feature.get('images', [])
-                infrastructure_image_ids.update(image_ids)
-        
-        # Query for vehicle and driving related content (new)
-        vehicle_query = ",".join(VEHICLE_RELATED_TYPES)
-        
-        vehicle_response = requests.get(
-            "https://graph.mapillary.com/map_features",
-            params={
-                "access_token": MAPILLARY_TOKEN,
-                "bbox": bbox,
-                "limit": 500,
-                "object_values": vehicle_query,
-                "fields": "id,object_value,images"
-            },
-            timeout=8
-        )
-        
-        # Collect image IDs with vehicle/driving content
-        vehicle_image_ids = set()
-        if vehicle_response.status_code == 200:
-            features = vehicle_response.json().get("data", [])
-            for feature in features:
-                image_ids = feature.get('images', [])
-                vehicle_image_ids.update(image_ids)
-        
-        # Score images based on educational content (more permissive)
-        educational_images = []
-        for img in images:
-            img_id = img['id']
-            
-            # Calculate scores for different categories
-            educational_score = 0.0
-            road_infrastructure_score = 0.0
-            vehicle_content_score = 0.0
-            
-            if img_id in traffic_sign_image_ids:
-                educational_score = 1.0
-            
-            if img_id in infrastructure_image_ids:
-                road_infrastructure_score = 1.0
-            
-            if img_id in vehicle_image_ids:
-                vehicle_content_score = 1.0
-            
-            # More permissive: if no specific content found, still give decent scores
-            # This allows more general street images that might contain driving situations
-            if educational_score == 0.0 and road_infrastructure_score == 0.0 and vehicle_content_score == 0.0:
-                educational_score = 0.6  # Increased from 0.3
-                road_infrastructure_score = 0.6  # Increased from 0.3
-                vehicle_content_score = 0.6  # New baseline
-            
-            img['educational_score'] = educational_score
-            img['road_infrastructure_score'] = road_infrastructure_score
-            img['vehicle_content_score'] = vehicle_content_score
-            
-            # More permissive: include images with any positive score
-            if educational_score > 0.0 or road_infrastructure_score > 0.0 or vehicle_content_score > 0.0:
-                educational_images.append(img)
-        
-        # Return all images with scores (more permissive)
-        if educational_images:
-            return educational_images
-        else:
-            # Assign default scores to all images (fallback)
-            for img in images:
-                img['educational_score'] = 0.7  # Higher default scores
-                img['road_infrastructure_score'] = 0.7
-                img['vehicle_content_score'] = 0.7
-            return images
-    
-    except:
-        # If detection fails, return all images with decent scoring
-        for img in images:
-            img['educational_score'] = 0.7  # Higher fallback scores
-            img['road_infrastructure_score'] = 0.7
-            img['vehicle_content_score'] = 0.7
-        return images
 
-def select_best_educational_image(images):
-    """Select the best image based on vehicle perspective and driving education value."""
-    if not images:
-        return None
-    
-    # Sort by educational score, then quality score (configurable weights)
-    def score_image(img):
-        educational_score = img.get('educational_score', 0)
-        road_infrastructure_score = img.get('road_infrastructure_score', 0)
-        vehicle_content_score = img.get('vehicle_content_score', 0)
-        vehicle_likelihood = img.get('vehicle_likelihood', 0.5)
-        road_validated = 1.0 if img.get('road_validated', False) else 0.0
-        quality_score = img.get('quality_score', 0.5)
-        recency_score = calculate_recency_score(img.get('captured_at', 0))
-        
-        # Weighted combined score prioritizing vehicle perspective
-        return (educational_score * EDUCATION_WEIGHT) + \
-               (road_infrastructure_score * ROAD_CONTENT_WEIGHT) + \
-               (vehicle_content_score * VEHICLE_CONTENT_WEIGHT) + \
-               (vehicle_likelihood * VEHICLE_PERSPECTIVE_WEIGHT) + \
-               (road_validated * ROAD_VALIDATION_WEIGHT) + \
-               (quality_score * QUALITY_WEIGHT) + \
-               (recency_score * RECENCY_WEIGHT)
-    
-    sorted_images = sorted(images, key=score_image, reverse=True)
-    
-    # Add some randomness among top candidates (configurable number)
-    top_candidates = sorted_images[:min(MAX_TOP_CANDIDATES, len(sorted_images))]
-    selected = random.choice(top_candidates)
-    
-    return selected
+        # Traffic signs, road infrastructure and vehicle/driving content (separate requests)
+        return {
+            "educational": _fetch_detection_image_ids(bbox, TRAFFIC_SIGN_TYPES),
+            "road_infrastructure": _fetch_detection_image_ids(bbox, ROAD_INFRASTRUCTURE_TYPES),
+            "vehicle_content": _fetch_detection_image_ids(bbox, VEHICLE_RELATED_TYPES),
+        }
 
-def calculate_recency_score(captured_at):
-    """Calculate a score based on how recent the image is (configurable thresholds)."""
-    if not captured_at:
-        return 0
-    
-    try:
-        # captured_at is in milliseconds since epoch
-        capture_date = datetime.fromtimestamp(captured_at / 1000)
-        now = datetime.now()
-        days_ago = (now - capture_date).days
-        
-        # More recent images get higher scores (configurable thresholds)
-        if days_ago < RECENT_THRESHOLD_DAYS:
-            return RECENT_SCORE
-        elif days_ago < MEDIUM_RECENT_DAYS:
-            return MEDIUM_RECENT_SCORE
-        elif days_ago < OLD_THRESHOLD_DAYS:
-            return OLD_SCORE
-        else:
-            return VERY_OLD_SCORE
     except:
-        return 0.5
+        # If detection fails, every image gets the fallback scores
+        return None
+
+def select_best_educational_image(candidates: ImageCandidates):
+    """Select the best image based on vehicle perspective and driving education value."""
+    return scoring_engine.select(candidates)
 
 def filter_vehicle_perspective_images(images):
     """Filter images to only include those likely taken from vehicles on roads."""
@@ -557,8 +432,8 @@ def validate_road_content_in_images(images, coords):
         # Search for mandatory road features
         mandatory_query = ",".join(MANDATORY_ROAD_FEATURES)
         
-        response = requests.get(
-            "https://graph.mapillary.com/map_features",
+        response = mapillary_session.get(
+            MAPILLARY_MAP_FEATURES_URL,
             params={
                 "access_token": MAPILLARY_TOKEN,
                 "bbox": bbox,
@@ -566,7 +441,6 @@ def validate_road_content_in_images(images, coords):
                 "object_values": mandatory_query,
                 "fields": "id,object_value,images"
             },
-            timeout=8
         )
         
         road_feature_image_ids = set()
@@ -1,29 +1,46 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, BackgroundTasks, HTTPException
 from typing import Optional
 import logging
 from typing import Dict
 
 from shared.constants import APIEndpoints, ExamAnswerMapping
 from controllers.driving_exam_chat_contoller import DrivingExamChatController
+from controllers.question_pool_controller import QuestionPoolController
+from shared.question_parser import QuestionGenerationError
 from api.schemas.exam_chat import ExamChatRequestBody, ExamChatResponseBody
 
 
 class ExamChatRoute:
 
-    def __init__(self, driving_exam_chat_controller: DrivingExamChatController, logger: Optional[logging.Logger]) -> None:
+    def __init__(
+        self,
+        driving_exam_chat_controller: DrivingExamChatController,
+        logger: Optional[logging.Logger],
+        question_pool_controller: Optional[QuestionPoolController] = None) -> None:
         self._driving_exam_chat_controller = driving_exam_chat_controller
+        self._question_pool_controller = question_pool_controller
         self._logger = logger or logging.getLogger(__name__)
     
     def add_api_routes(self, router: APIRouter) -> None:
         router.add_api_route(APIEndpoints.EXAM_CHAT.value, self.post, methods=['POST'])
     
-    async def post(self, body: ExamChatRequestBody) -> ExamChatResponseBody:
+    async def post(self, body: ExamChatRequestBody, background_tasks: BackgroundTasks) -> ExamChatResponseBody:
         self._logger.info(f"Received request for exam chat.")
 
-        chat_id, results = self._driving_exam_chat_controller.generate_driving_questions_for_image(
-            image_url=body.image_url,
-            city=body.city
-        )
+        pooled = None
+        if self._question_pool_controller:
+            pooled = self._question_pool_controller.take_question(body.image_url, body.city)
+        if pooled:
+            chat_id, results = pooled
+        else:
+            try:
+                chat_id, results = await self._driving_exam_chat_controller.generate_driving_questions_for_image(
+                    image_url=body.image_url,
+                    city=body.city
+                )
+            except QuestionGenerationError as e:
+                raise HTTPException(status_code=502, detail=str(e))
+            background_tasks.add_task(self._driving_exam_chat_controller.flush_chat_history, chat_id)
 
         result_body = ExamChatResponseBody(
             image_url=body.image_url,
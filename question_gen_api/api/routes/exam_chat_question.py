@@ -1,5 +1,7 @@
-from fastapi import APIRouter, Request
-from typing import Optional
+from fastapi import APIRouter, Request, BackgroundTasks, HTTPException
+from fastapi.responses import StreamingResponse
+from typing import Optional, AsyncIterator, AsyncGenerator
+import json
 import logging
 from typing import Dict
 
@@ -16,14 +18,16 @@ class ExamChatQuestionRoute:
     
     def add_api_routes(self, router: APIRouter) -> None:
         router.add_api_route(APIEndpoints.EXAM_CHAT_QUESTION.value, self.post, methods=['POST'])
+        router.add_api_route(APIEndpoints.EXAM_CHAT_QUESTION_STREAM.value, self.post_stream, methods=['POST'])
     
-    async def post(self, body: ExamChatQuestionRequestBody) -> ExamChatQuestionResponseBody:
+    async def post(self, body: ExamChatQuestionRequestBody, background_tasks: BackgroundTasks) -> ExamChatQuestionResponseBody:
         self._logger.info(f"Received request for exam chat.")
 
-        response = self._driving_exam_chat_controller.ask_followup_question(
+        response = await self._driving_exam_chat_controller.ask_followup_question(
             question=body.question,
             chat_id=body.chat_id,
         )
+        background_tasks.add_task(self._driving_exam_chat_controller.flush_chat_history, body.chat_id)
         
         print(f"Response: {response}")
         result_body = ExamChatQuestionResponseBody(
@@ -31,4 +35,49 @@ class ExamChatQuestionRoute:
             chat_id=body.chat_id
         )
         self._logger.info(f"Generated exam chat results")
-        return result_body
\ No newline at end of file
+        return result_body
+
+
+    async def post_stream(self, body: ExamChatQuestionRequestBody, background_tasks: BackgroundTasks) -> StreamingResponse:
+        """
+        Server-sent events: one `data: {"delta": ...}` event per chunk of the answer,
+        then `event: done` with the full response, or `event: error` if generation fails.
+        """
+        self._logger.info(f"Received streaming request for exam chat.")
+
+        answer = self._driving_exam_chat_controller.stream_followup_question(
+            question=body.question,
+            chat_id=body.chat_id,
+        )
+        try:
+            # Pull the first chunk before answering so an unknown chat still gets a proper 404
+            first_chunk = await anext(answer, None)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Unknown chat {body.chat_id}")
+        background_tasks.add_task(self._driving_exam_chat_controller.flush_chat_history, body.chat_id)
+
+        return StreamingResponse(
+            self._sse_events(body.chat_id, first_chunk, answer),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+    async def _sse_events(self, chat_id: str, first_chunk: Optional[str], answer: AsyncGenerator[str, None]) -> AsyncIterator[str]:
+        parts = []
+        try:
+            if first_chunk is not None:
+                parts.append(first_chunk)
+                yield f"data: {json.dumps({'delta': first_chunk})}\n\n"
+            async for chunk in answer:
+                parts.append(chunk)
+                yield f"data: {json.dumps({'delta': chunk})}\n\n"
+        except Exception as e:
+            self._logger.error(f"Streaming answer for chat {chat_id} failed: {e}")
+            yield f"event: error\ndata: {json.dumps({'chat_id': chat_id, 'detail': 'Generating the answer failed'})}\n\n"
+            return
+        finally:
+            # Runs on client disconnect too, so the controller drops the unanswered turn right away
+            await answer.aclose()
+        self._logger.info(f"Streamed exam chat results")
+        yield f"event: done\ndata: {json.dumps({'chat_id': chat_id, 'response': ''.join(parts)})}\n\n"
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, BackgroundTasks, HTTPException
 from typing import Optional
 import logging
 from typing import Dict
@@ -6,6 +6,7 @@ from typing import Dict
 from shared.constants import APIEndpoints, ExamAnswerMapping
 from controllers.similarity_search_controller import SimilaritySearchController
 from controllers.driving_exam_chat_contoller import DrivingExamChatController
+from shared.question_parser import QuestionGenerationError
 from api.schemas.similiarity_search import SimilaritySearchRequestBody, SimilaritySearchResponseBody
 
 
@@ -22,17 +23,30 @@ class SimilaritySearchRoute:
     def add_api_routes(self, router: APIRouter) -> None:
         router.add_api_route(APIEndpoints.SIMILARITY_SEARCH.value, self.post, methods=['POST'])
     
-    async def post(self, body: SimilaritySearchRequestBody) -> SimilaritySearchResponseBody:
+    async def post(self, body: SimilaritySearchRequestBody, background_tasks: BackgroundTasks) -> SimilaritySearchResponseBody:
         self._logger.info(f"Received request for similiarity search.")
 
-        response = self._similarity_search_controller.search(
+        response = await self._similarity_search_controller.search(
             query=body.query,
             top_k=1,
+            city=body.city,
+            sign_categories=body.sign_categories,
         )
+        if not response and (body.city or body.sign_categories):
+            # Questions indexed before city and sign metadata was stored never match a filter
+            self._logger.info(f"No filtered match for similarity search, searching the whole index.")
+            response = await self._similarity_search_controller.search(query=body.query, top_k=1)
+        if not response:
+            raise HTTPException(status_code=404, detail="No matching question found")
         image_url = response[0]
-        chat_id, results = self._driving_exam_controller.generate_driving_questions_for_image(
-            image_url=image_url,
-        )
+        try:
+            chat_id, results = await self._driving_exam_controller.generate_driving_questions_for_image(
+                image_url=image_url,
+                city=body.city or "Paris",
+            )
+        except QuestionGenerationError as e:
+            raise HTTPException(status_code=502, detail=str(e))
+        background_tasks.add_task(self._driving_exam_controller.flush_chat_history, chat_id)
         
         result_body = SimilaritySearchResponseBody(
             image_url=image_url,
@@ -5,13 +5,21 @@ from typing import Dict
 
 from shared.constants import APIEndpoints
 from controllers.street_image_controller_script import download_street_image
+from controllers.street_image_catalog_controller import StreetImageCatalogController
+from controllers.question_pool_controller import QuestionPoolController
 from api.schemas.street_image import StreetImageRequestBody, StreetImageResponseBody
 
 
 class StreetImageRoute:
 
-    def __init__(self, logger: Optional[logging.Logger]) -> None:
+    def __init__(
+        self,
+        logger: Optional[logging.Logger],
+        street_image_catalog_controller: Optional[StreetImageCatalogController] = None,
+        question_pool_controller: Optional[QuestionPoolController] = None) -> None:
         self._logger = logger or logging.getLogger(__name__)
+        self._street_image_catalog_controller = street_image_catalog_controller
+        self._question_pool_controller = question_pool_controller
     
     def add_api_routes(self, router: APIRouter) -> None:
         router.add_api_route(APIEndpoints.STREET_IMAGE.value, self.post, methods=['POST'])
@@ -19,7 +27,15 @@ class StreetImageRoute:
     async def post(self, body: StreetImageRequestBody) -> StreetImageResponseBody:
         self._logger.info(f"Received request for street image.")
 
-        image_url = download_street_image(body.city, limit=10)
+        image_url = None
+        # Prefer images whose question is already generated so /exam-chat can answer instantly
+        if self._question_pool_controller:
+            image_url = self._question_pool_controller.ready_image_url(body.city)
+        if not image_url and self._street_image_catalog_controller:
+            image_url = await self._street_image_catalog_controller.get_street_image_url(body.city)
+        if not image_url:
+            # City not catalogued (yet), fall back to querying Mapillary directly
+            image_url = await download_street_image(body.city, limit=10)
 
         result_body = StreetImageResponseBody(
             image_url=image_url,
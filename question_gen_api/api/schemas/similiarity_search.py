@@ -4,6 +4,8 @@ from typing import Optional, List
 
 class SimilaritySearchRequestBody(BaseModel):
     query: str
+    city: Optional[str] = None
+    sign_categories: Optional[List[str]] = None  # Mapillary sign categories: regulatory, warning, information
 
 
 class AnswerChoice(BaseModel):
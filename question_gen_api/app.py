@@ -1,5 +1,6 @@
 import os
 import logging
+from typing import Optional
 from fastapi import FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from mistralai import Mistral
@@ -8,16 +9,32 @@ from dotenv import load_dotenv, find_dotenv
 
 from clients.s3_client import AWSS3Client
 from clients.role_assumer_client import AWSRoleAssumer
+from clients.chat_store import create_chat_store
+from clients.question_cache import create_question_cache
+from clients.embedding_cache import EmbeddingCache
+from clients.vector_index import LocalVectorIndex
 from controllers.driving_exam_chat_contoller import DrivingExamChatController
 from controllers.street_image_controller import StreetImageController
 from controllers.similarity_search_controller import SimilaritySearchController
+from controllers.street_image_catalog_controller import StreetImageCatalogController
+from controllers.question_pool_controller import QuestionPoolController
+from clients.street_image_catalog_store import StreetImageCatalogStore
 from api.routes.exam_chat import ExamChatRoute
 from api.routes.exam_chat_question import ExamChatQuestionRoute
 from api.routes.street_image import StreetImageRoute
 from api.routes.similarity_search import SimilaritySearchRoute
 from api.routes.liveness import LivenessRoute
+from shared.context_window import ContextWindow
 from shared.constants import (
     APIEndpoints,
+    CHAT_CONTEXT_TOKEN_BUDGET,
+    ChatPersistenceMode,
+    ChatStoreBackend,
+    QuestionCacheBackend,
+    VectorIndexBackend,
+    QUESTION_CACHE_VARIANTS,
+    STREET_IMAGE_CATALOG_PATH,
+    SUPPORTED_CITY_COORDINATES,
 )
 
 load_dotenv(find_dotenv(), override=True)
@@ -30,6 +47,21 @@ def create_app(
     mapillary_token: str,
     index_url: str,
     index_token: str,
+    street_image_catalog_path: str = STREET_IMAGE_CATALOG_PATH,
+    street_image_catalog_enabled: bool = False,
+    question_pool_enabled: bool = False,
+    chat_persistence_mode: ChatPersistenceMode = ChatPersistenceMode.WRITE_THROUGH,
+    chat_store_backend: ChatStoreBackend = ChatStoreBackend.S3,
+    chat_store_path: Optional[str] = None,
+    chat_context_max_exchanges: Optional[int] = None,
+    chat_context_token_budget: int = CHAT_CONTEXT_TOKEN_BUDGET,
+    question_cache_backend: Optional[QuestionCacheBackend] = None,
+    question_cache_path: Optional[str] = None,
+    question_cache_variants: int = QUESTION_CACHE_VARIANTS,
+    embedding_cache_path: Optional[str] = None,
+    vector_index_backend: VectorIndexBackend = VectorIndexBackend.UPSTASH,
+    vector_index_path: Optional[str] = None,
+    vector_index_approximate: bool = False,
     env: str='prod'
     ) -> FastAPI:
     
@@ -53,22 +85,74 @@ def create_app(
     router = APIRouter()
     
     
+    chat_store = create_chat_store(chat_store_backend, s3_client=s3_client, path=chat_store_path)
+    logger.info(f"Using {chat_store_backend.value} chat store")
+
+    context_window = None
+    if chat_context_max_exchanges is not None:
+        context_window = ContextWindow(
+            max_exchanges=chat_context_max_exchanges,
+            token_budget=chat_context_token_budget,
+            logger=logger,
+        )
+
+    question_cache = None
+    if question_cache_backend:
+        question_cache = create_question_cache(question_cache_backend, s3_client=s3_client, path=question_cache_path)
+        logger.info(f"Using {question_cache_backend.value} question cache")
+
     driving_exam_chat_controller = DrivingExamChatController(
         mistral_client=mistral_client,
-        s3_client=s3_client,
-        logger=logger
+        chat_store=chat_store,
+        logger=logger,
+        persistence_mode=chat_persistence_mode,
+        context_window=context_window,
+        question_cache=question_cache,
+        question_cache_variants=question_cache_variants,
     )
 
     #street_image_controller = StreetImageController(api_token=mapillary_token)
 
+    street_image_catalog_controller = None
+    if street_image_catalog_enabled:
+        street_image_catalog_controller = StreetImageCatalogController(
+            store=StreetImageCatalogStore(street_image_catalog_path),
+            cities=list(SUPPORTED_CITY_COORDINATES),
+            logger=logger,
+        )
+        app.add_event_handler("startup", street_image_catalog_controller.start_background_refresh)
+        app.add_event_handler("shutdown", street_image_catalog_controller.stop_background_refresh)
+
+    question_pool_controller = None
+    if question_pool_enabled:
+        question_pool_controller = QuestionPoolController(
+            driving_exam_chat_controller=driving_exam_chat_controller,
+            cities=list(SUPPORTED_CITY_COORDINATES),
+            street_image_catalog_controller=street_image_catalog_controller,
+            logger=logger,
+        )
+        app.add_event_handler("startup", question_pool_controller.start_background_refill)
+        app.add_event_handler("shutdown", question_pool_controller.stop_background_refill)
+
+    vector_index = None
+    if vector_index_backend == VectorIndexBackend.LOCAL:
+        vector_index = LocalVectorIndex(
+            snapshot_path=vector_index_path,
+            approximate=vector_index_approximate,
+            logger=logger,
+        )
+    logger.info(f"Using {vector_index_backend.value} vector index")
+
     similarity_search_controller = SimilaritySearchController(
         index_url=index_url,
         api_key=index_token,
         mistral_client=mistral_client,
         logger=logger,
+        embedding_cache=EmbeddingCache(store_path=embedding_cache_path),
+        index=vector_index,
     )
 
-    exam_chat_route = ExamChatRoute(driving_exam_chat_controller, logger)
+    exam_chat_route = ExamChatRoute(driving_exam_chat_controller, logger, question_pool_controller)
     logger.info("Adding exam chat routes")
     exam_chat_route.add_api_routes(router)
     logger.info("Added exam chat routes")
@@ -78,7 +162,7 @@ def create_app(
     exam_chat_route.add_api_routes(router)
     logger.info("Added exam question chat routes")
 
-    exam_chat_route = StreetImageRoute(logger)
+    exam_chat_route = StreetImageRoute(logger, street_image_catalog_controller, question_pool_controller)
     logger.info("Adding street image routes")
     exam_chat_route.add_api_routes(router)
     logger.info("Added street image routes")
@@ -106,6 +190,23 @@ mapillary_token = os.getenv("MAPILLARY_TOKEN")
 mistral_api_key = os.getenv("MISTRAL_API_KEY")
 index_url = os.getenv("VECTOR_DB_ENDPOINT", None)
 index_token = os.getenv("VECTOR_DB_API_KEY", None)
+street_image_catalog_path = os.getenv("STREET_IMAGE_CATALOG_PATH", STREET_IMAGE_CATALOG_PATH)
+street_image_catalog_enabled = os.getenv("STREET_IMAGE_CATALOG_ENABLED", "false").lower() == "true"
+question_pool_enabled = os.getenv("QUESTION_POOL_ENABLED", "false").lower() == "true"
+chat_persistence_mode = ChatPersistenceMode(os.getenv("CHAT_PERSISTENCE_MODE", ChatPersistenceMode.WRITE_THROUGH.value))
+chat_store_backend = ChatStoreBackend(os.getenv("CHAT_STORE_BACKEND", ChatStoreBackend.S3.value))
+chat_store_path = os.getenv("CHAT_STORE_PATH", None)
+chat_context_max_exchanges = os.getenv("CHAT_CONTEXT_MAX_EXCHANGES", None)
+chat_context_max_exchanges = int(chat_context_max_exchanges) if chat_context_max_exchanges else None
+chat_context_token_budget = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", CHAT_CONTEXT_TOKEN_BUDGET))
+question_cache_backend = os.getenv("QUESTION_CACHE_BACKEND", None)
+question_cache_backend = QuestionCacheBackend(question_cache_backend) if question_cache_backend else None
+question_cache_path = os.getenv("QUESTION_CACHE_PATH", None)
+question_cache_variants = int(os.getenv("QUESTION_CACHE_VARIANTS", QUESTION_CACHE_VARIANTS))
+embedding_cache_path = os.getenv("EMBEDDING_CACHE_PATH", None)
+vector_index_backend = VectorIndexBackend(os.getenv("VECTOR_INDEX_BACKEND", VectorIndexBackend.UPSTASH.value))
+vector_index_path = os.getenv("VECTOR_INDEX_PATH", None)
+vector_index_approximate = os.getenv("VECTOR_INDEX_APPROXIMATE", "false").lower() == "true"
 mistral_client = Mistral(api_key=mistral_api_key)
 
 role_arn = os.getenv("AWS_ROLE_ARN", None)
@@ -131,6 +232,21 @@ try:
         mapillary_token=mapillary_token,
         index_url=index_url,
         index_token=index_token,
+        street_image_catalog_path=street_image_catalog_path,
+        street_image_catalog_enabled=street_image_catalog_enabled,
+        question_pool_enabled=question_pool_enabled,
+        chat_persistence_mode=chat_persistence_mode,
+        chat_store_backend=chat_store_backend,
+        chat_store_path=chat_store_path,
+        chat_context_max_exchanges=chat_context_max_exchanges,
+        chat_context_token_budget=chat_context_token_budget,
+        question_cache_backend=question_cache_backend,
+        question_cache_path=question_cache_path,
+        question_cache_variants=question_cache_variants,
+        embedding_cache_path=embedding_cache_path,
+        vector_index_backend=vector_index_backend,
+        vector_index_path=vector_index_path,
+        vector_index_approximate=vector_index_approximate,
         env=ENV
         )
 except Exception as e:
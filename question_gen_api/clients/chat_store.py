@@ -0,0 +1,290 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import cached_property
+from typing import Dict, Iterator, List, Optional
+
+from botocore.exceptions import ClientError
+
+from clients.s3_client import AWSS3Client
+from shared.constants import (
+    S3_BUCKET_NAME,
+    CHAT_S3_PREFIX,
+    CHAT_LOAD_ATTEMPTS,
+    CHAT_STORE_LOCAL_DIR,
+    CHAT_STORE_SQLITE_PATH,
+    ChatStoreBackend,
+)
+
+
+class ChatHistory:
+    """
+    A stored chat as its raw append-only segments. Each segment is a JSON document
+    {created_at, first_index, messages}; the message list is only decoded and
+    stitched together on first access.
+    """
+
+    def __init__(self, segments: List[str]) -> None:
+        if not segments:
+            raise ValueError("A chat history needs at least one segment")
+        self._raw_segments = segments
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._raw_segments)
+
+    @property
+    def created_at(self) -> str:
+        return self._segments[0]["created_at"]
+
+    @cached_property
+    def messages(self) -> List[Dict]:
+        messages = []
+        for segment in self._segments:
+            # Segments may overlap after a retried append or a concurrent compaction
+            skip = len(messages) - segment["first_index"]
+            if skip < 0:
+                raise ValueError(f"Chat history has a gap before message {segment['first_index']}")
+            messages.extend(segment["messages"][skip:])
+        return messages
+
+    @cached_property
+    def _segments(self) -> List[Dict]:
+        segments = [json.loads(raw) for raw in self._raw_segments]
+        for segment in segments:
+            # Chats written before the segmented format are a single full document
+            segment.setdefault("first_index", 0)
+        return sorted(segments, key=lambda segment: segment["first_index"])
+
+
+def encode_segment(created_at: str, first_index: int, messages: List[Dict]) -> str:
+    return json.dumps({"created_at": created_at, "first_index": first_index, "messages": messages})
+
+
+class ChatStore(ABC):
+    """
+    Append-only persistence for exam chats: every turn stores only its new messages
+    as a segment, so write volume per turn stays constant as a conversation grows.
+    """
+
+    @abstractmethod
+    async def load(self, chat_id: str) -> Optional[ChatHistory]:
+        """Returns the stored chat, or None if it does not exist."""
+
+    @abstractmethod
+    async def append(self, chat_id: str, created_at: str, first_index: int, messages: List[Dict]) -> None:
+        """Stores `messages`, which start at position `first_index` of the chat."""
+
+    @abstractmethod
+    async def compact(self, chat_id: str) -> None:
+        """Merges all segments of a chat into one."""
+
+
+class S3ChatStore(ChatStore):
+    """
+    Segments are objects under {prefix}{chat_id}/, named after their first message index.
+    Chats saved before segments were introduced are a single {prefix}{chat_id}.json
+    document, which stays the first segment until the chat is compacted.
+    """
+
+    def __init__(
+        self,
+        s3_client: AWSS3Client,
+        bucket_name: str = S3_BUCKET_NAME,
+        prefix: str = CHAT_S3_PREFIX,
+        load_attempts: int = CHAT_LOAD_ATTEMPTS,
+        ) -> None:
+        self._s3_client = s3_client
+        self._bucket_name = bucket_name
+        self._prefix = prefix
+        self._load_attempts = load_attempts
+
+    async def load(self, chat_id: str) -> Optional[ChatHistory]:
+        for attempt in range(1, self._load_attempts + 1):
+            keys = await self._s3_client.list_folder_objects_async(self._bucket_name, f"{self._prefix}{chat_id}/")
+            segmented = bool(keys)
+            if self._segment_key(chat_id, 0) not in keys:
+                # Chat saved before segments were introduced, its later turns are segments on top of it
+                keys = [self._legacy_key(chat_id), *keys]
+            try:
+                payloads = await asyncio.gather(*(
+                    self._s3_client.read_file_async(bucket_name=self._bucket_name, object_key=key)
+                    for key in keys
+                ))
+            except ClientError as e:
+                if not _is_missing_key(e):
+                    raise
+                if not segmented:
+                    return None
+                # A compaction deleted a listed segment after merging it into the first one, list again
+                if attempt == self._load_attempts:
+                    raise
+                continue
+            return ChatHistory([payload.read().decode('utf-8') for payload in payloads])
+
+    async def append(self, chat_id: str, created_at: str, first_index: int, messages: List[Dict]) -> None:
+        await self._s3_client.write_file_async(
+            bucket_name=self._bucket_name,
+            object_key=self._segment_key(chat_id, first_index),
+            byte_reader=encode_segment(created_at, first_index, messages).encode('utf-8')
+        )
+
+    async def compact(self, chat_id: str) -> None:
+        keys = await self._s3_client.list_folder_objects_async(self._bucket_name, f"{self._prefix}{chat_id}/")
+        if len(keys) <= 1:
+            return
+        history = await self.load(chat_id)
+        merged_key = self._segment_key(chat_id, 0)
+        # Write the merged segment first: a reader in between sees overlapping segments, never a gap
+        await self._s3_client.write_file_async(
+            bucket_name=self._bucket_name,
+            object_key=merged_key,
+            byte_reader=encode_segment(history.created_at, 0, history.messages).encode('utf-8')
+        )
+        stale_keys = [key for key in keys if key != merged_key]
+        if merged_key not in keys:
+            # The legacy document was the first segment and is now merged
+            stale_keys.append(self._legacy_key(chat_id))
+        await self._s3_client.delete_files_async(self._bucket_name, stale_keys)
+
+    def _segment_key(self, chat_id: str, first_index: int) -> str:
+        return f"{self._prefix}{chat_id}/{first_index:06d}.json"
+
+    def _legacy_key(self, chat_id: str) -> str:
+        return f"{self._prefix}{chat_id}.json"
+
+
+def _is_missing_key(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404")
+
+
+class LocalChatStore(ChatStore):
+    """
+    One JSON-lines file per chat, every line is a segment. Appends and compactions
+    of a chat hold its lock, so an append never lands in a file that a compaction
+    is about to replace.
+    """
+
+    def __init__(self, root_dir: str = CHAT_STORE_LOCAL_DIR, lock_stripes: int = 64) -> None:
+        self._root_dir = root_dir
+        # A fixed set of locks shared by hash, so the lock table does not grow with the number of chats
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+        os.makedirs(root_dir, exist_ok=True)
+
+    async def load(self, chat_id: str) -> Optional[ChatHistory]:
+        return await asyncio.to_thread(self._read, chat_id)
+
+    async def append(self, chat_id: str, created_at: str, first_index: int, messages: List[Dict]) -> None:
+        await asyncio.to_thread(self._append, chat_id, encode_segment(created_at, first_index, messages))
+
+    async def compact(self, chat_id: str) -> None:
+        await asyncio.to_thread(self._compact, chat_id)
+
+    def _path(self, chat_id: str) -> str:
+        return os.path.join(self._root_dir, f"{os.path.basename(chat_id)}.jsonl")
+
+    def _read(self, chat_id: str) -> Optional[ChatHistory]:
+        try:
+            with open(self._path(chat_id), "r", encoding="utf-8") as f:
+                segments = [line for line in f.read().splitlines() if line]
+        except FileNotFoundError:
+            return None
+        return ChatHistory(segments) if segments else None
+
+    def _lock(self, chat_id: str) -> threading.Lock:
+        return self._locks[hash(chat_id) % len(self._locks)]
+
+    def _append(self, chat_id: str, segment: str) -> None:
+        with self._lock(chat_id):
+            with open(self._path(chat_id), "a", encoding="utf-8") as f:
+                f.write(segment + "\n")
+
+    def _compact(self, chat_id: str) -> None:
+        with self._lock(chat_id):
+            history = self._read(chat_id)
+            if history is None or history.segment_count <= 1:
+                return
+            path = self._path(chat_id)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(encode_segment(history.created_at, 0, history.messages) + "\n")
+            os.replace(tmp_path, path)
+
+
+class SQLiteChatStore(ChatStore):
+
+    def __init__(self, db_path: str = CHAT_STORE_SQLITE_PATH) -> None:
+        self._db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chat_segments (
+                    chat_id TEXT NOT NULL,
+                    first_index INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, first_index)
+                )
+                """
+            )
+
+    async def load(self, chat_id: str) -> Optional[ChatHistory]:
+        return await asyncio.to_thread(self._read, chat_id)
+
+    async def append(self, chat_id: str, created_at: str, first_index: int, messages: List[Dict]) -> None:
+        await asyncio.to_thread(self._append, chat_id, first_index, encode_segment(created_at, first_index, messages))
+
+    async def compact(self, chat_id: str) -> None:
+        await asyncio.to_thread(self._compact, chat_id)
+
+    def _read(self, chat_id: str, conn: Optional[sqlite3.Connection] = None) -> Optional[ChatHistory]:
+        if conn is None:
+            with self._connect() as conn:
+                return self._read(chat_id, conn)
+        rows = conn.execute(
+            "SELECT payload FROM chat_segments WHERE chat_id = ? ORDER BY first_index", (chat_id,)
+        ).fetchall()
+        return ChatHistory([row[0] for row in rows]) if rows else None
+
+    def _append(self, chat_id: str, first_index: int, segment: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chat_segments (chat_id, first_index, payload) VALUES (?, ?, ?)",
+                (chat_id, first_index, segment),
+            )
+
+    def _compact(self, chat_id: str) -> None:
+        with self._connect() as conn:
+            history = self._read(chat_id, conn)
+            if history is None or history.segment_count <= 1:
+                return
+            conn.execute("DELETE FROM chat_segments WHERE chat_id = ?", (chat_id,))
+            conn.execute(
+                "INSERT INTO chat_segments (chat_id, first_index, payload) VALUES (?, 0, ?)",
+                (chat_id, encode_segment(history.created_at, 0, history.messages)),
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self._db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+def create_chat_store(backend: ChatStoreBackend, s3_client: Optional[AWSS3Client] = None, path: Optional[str] = None) -> ChatStore:
+    if backend == ChatStoreBackend.S3:
+        if s3_client is None:
+            raise ValueError("The S3 chat store needs an s3_client")
+        return S3ChatStore(s3_client)
+    if backend == ChatStoreBackend.LOCAL:
+        return LocalChatStore(path or CHAT_STORE_LOCAL_DIR)
+    if backend == ChatStoreBackend.SQLITE:
+        return SQLiteChatStore(path or CHAT_STORE_SQLITE_PATH)
+    raise ValueError(f"Unknown chat store backend {backend}")
@@ -0,0 +1,92 @@
+import asyncio
+import sqlite3
+from array import array
+from contextlib import contextmanager
+from typing import Optional, Dict, Iterator, List
+
+from shared.cache import LRUCache
+from shared.constants import EMBEDDING_CACHE_MAX_SIZE, MISTRAL_EMBEDDING_MODEL
+
+
+class EmbeddingCache:
+    """
+    Embeddings of search queries, keyed by the normalized query text.
+    An in-process LRU in front of an optional SQLite file that survives restarts;
+    vectors are stored as float32 blobs.
+    """
+
+    def __init__(
+        self,
+        max_size: int = EMBEDDING_CACHE_MAX_SIZE,
+        store_path: Optional[str] = None,
+        model: str = MISTRAL_EMBEDDING_MODEL,
+        ) -> None:
+        self._cache = LRUCache(max_size=max_size)
+        self._store_path = store_path
+        self._model = model
+        self.store_hits = 0
+        if store_path:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS embeddings (
+                        model TEXT NOT NULL,
+                        text TEXT NOT NULL,
+                        vector BLOB NOT NULL,
+                        PRIMARY KEY (model, text)
+                    )
+                    """
+                )
+
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split()).casefold()
+
+
+    async def get(self, text: str) -> Optional[List[float]]:
+        """`text` must already be normalized."""
+        embedding = self._cache.get(text)
+        if embedding is not None or not self._store_path:
+            return embedding
+        embedding = await asyncio.to_thread(self._read, text)
+        if embedding is not None:
+            self.store_hits += 1
+            self._cache.set(text, embedding)
+        return embedding
+
+
+    async def set(self, text: str, embedding: List[float]) -> None:
+        self._cache.set(text, embedding)
+        if self._store_path:
+            await asyncio.to_thread(self._write, text, embedding)
+
+
+    def stats(self) -> Dict:
+        return {**self._cache.stats(), "store_hits": self.store_hits}
+
+
+    def _read(self, text: str) -> Optional[List[float]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT vector FROM embeddings WHERE model = ? AND text = ?", (self._model, text)
+            ).fetchone()
+        return array("f", row[0]).tolist() if row else None
+
+
+    def _write(self, text: str, embedding: List[float]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO embeddings (model, text, vector) VALUES (?, ?, ?)",
+                (self._model, text, array("f", embedding).tobytes()),
+            )
+
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self._store_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
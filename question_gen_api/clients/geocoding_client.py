@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Optional, Dict
+
+from clients.mapillary_client import MapillaryClient
+from shared.cache import LRUCache
+from shared.constants import (
+    NOMINATIM_SEARCH_URL,
+    NOMINATIM_USER_AGENT,
+    GEOCODE_CACHE_MAX_SIZE,
+    GEOCODE_CACHE_TTL_SECONDS,
+    SUPPORTED_CITY_COORDINATES,
+)
+
+
+class GeocodingClient:
+    """
+    City -> coordinates lookups backed by Nominatim with three cache layers:
+    a preloaded table of supported cities, an in-process LRU with TTL and an
+    optional JSON file that survives restarts.
+    """
+
+    def __init__(
+        self,
+        store_path: Optional[str] = None,
+        max_size: int = GEOCODE_CACHE_MAX_SIZE,
+        ttl_seconds: float = GEOCODE_CACHE_TTL_SECONDS,
+        preloaded: Optional[Dict[str, Dict[str, float]]] = None,
+        logger: Optional[logging.Logger] = None,
+        ) -> None:
+        self._store_path = store_path
+        self._ttl_seconds = ttl_seconds
+        self._cache = LRUCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self._logger = logger or logging.getLogger(__name__)
+        preloaded = SUPPORTED_CITY_COORDINATES if preloaded is None else preloaded
+        self._preloaded = {self._normalize(city): coords for city, coords in preloaded.items()}
+        self._store = self._load_store()
+        self._pending: Dict[str, asyncio.Future] = {}
+
+
+    async def get_coordinates(self, city: str, client: MapillaryClient) -> Optional[Dict[str, float]]:
+        key = self._normalize(city)
+        if key in self._preloaded:
+            return self._preloaded[key]
+
+        coords = self._cache.get(key)
+        if coords is not None:
+            return coords
+
+        coords = self._get_stored(key)
+        if coords is not None:
+            self._cache.set(key, coords)
+            return coords
+
+        # Concurrent misses for the same city share one Nominatim request
+        if key in self._pending:
+            return await asyncio.shield(self._pending[key])
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            coords = await self._fetch(city, client)
+            future.set_result(coords)
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._pending[key]
+
+        if coords is not None:
+            self._cache.set(key, coords)
+            self._put_stored(key, coords)
+        return coords
+
+
+    def stats(self) -> Dict:
+        return self._cache.stats()
+
+
+    async def _fetch(self, city: str, client: MapillaryClient) -> Optional[Dict[str, float]]:
+        """Gets city coordinates via Nominatim geocoding service."""
+        try:
+            response = await client.get(
+                NOMINATIM_SEARCH_URL,
+                params={"q": city, "format": "json", "limit": 1},
+                headers={"User-Agent": NOMINATIM_USER_AGENT},
+            )
+
+            data = response.json()
+            if not data:
+                return None
+
+            return {"lat": float(data[0]["lat"]), "lon": float(data[0]["lon"])}
+        except Exception as e:
+            self._logger.warning(f"Geocoding {city} failed: {e}")
+            return None
+
+
+    def _load_store(self) -> Dict:
+        if not self._store_path or not os.path.exists(self._store_path):
+            return {}
+        try:
+            with open(self._store_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self._logger.warning(f"Ignoring unreadable geocode store {self._store_path}: {e}")
+            return {}
+
+
+    def _get_stored(self, key: str) -> Optional[Dict[str, float]]:
+        entry = self._store.get(key)
+        if not entry or time.time() - entry["cached_at"] > self._ttl_seconds:
+            return None
+        return {"lat": entry["lat"], "lon": entry["lon"]}
+
+
+    def _put_stored(self, key: str, coords: Dict[str, float]) -> None:
+        if not self._store_path:
+            return
+        self._store[key] = {**coords, "cached_at": time.time()}
+        tmp_path = f"{self._store_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._store, f)
+            os.replace(tmp_path, self._store_path)
+        except OSError as e:
+            self._logger.warning(f"Could not persist geocode store {self._store_path}: {e}")
+
+
+    @staticmethod
+    def _normalize(city: str) -> str:
+        return " ".join(city.split()).casefold()
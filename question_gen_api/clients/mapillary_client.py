@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import random
+import time
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from shared.constants import (
+    NOMINATIM_USER_AGENT,
+    HTTP_ENDPOINT_TIMEOUT_SECONDS,
+    HTTP_DEFAULT_TIMEOUT_SECONDS,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    HTTP_MAX_RETRIES,
+    HTTP_RETRY_BACKOFF_SECONDS,
+    HTTP_RETRY_MAX_BACKOFF_SECONDS,
+    HTTP_RETRY_STATUS_CODES,
+    MAPILLARY_MAX_PAGES,
+)
+
+# Filters one result page down to the usable candidates
+PageFilter = Callable[[List[Dict]], List[Dict]]
+
+
+class _RetryPolicy:
+    """Retries 429/5xx answers and connection errors with full-jitter exponential backoff."""
+
+    def __init__(
+        self,
+        max_retries: int = HTTP_MAX_RETRIES,
+        backoff_seconds: float = HTTP_RETRY_BACKOFF_SECONDS,
+        max_backoff_seconds: float = HTTP_RETRY_MAX_BACKOFF_SECONDS,
+        logger: Optional[logging.Logger] = None,
+        ) -> None:
+        self._max_retries = max_retries
+        self._backoff_seconds = backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._logger = logger or logging.getLogger(__name__)
+        self.retries = 0
+
+
+    def _should_retry(self, attempt: int, status_code: Optional[int]) -> bool:
+        return attempt < self._max_retries and (status_code is None or status_code in HTTP_RETRY_STATUS_CODES)
+
+
+    def _delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        # A numeric Retry-After (sent with 429) takes precedence over our own backoff
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self._max_backoff_seconds)
+        return random.uniform(0, min(self._max_backoff_seconds, self._backoff_seconds * 2 ** attempt))
+
+
+    def _log_retry(self, url: str, attempt: int, reason: str, delay: float) -> None:
+        self.retries += 1
+        self._logger.warning(f"GET {url} failed ({reason}), retry {attempt + 1}/{self._max_retries} in {delay:.2f}s")
+
+
+    @staticmethod
+    def _timeout(url: str, timeout: Optional[float]) -> float:
+        if timeout is not None:
+            return timeout
+        # paging.next URLs carry their query string
+        return HTTP_ENDPOINT_TIMEOUT_SECONDS.get(url.split("?", 1)[0], HTTP_DEFAULT_TIMEOUT_SECONDS)
+
+
+class MapillaryClient(_RetryPolicy):
+    """
+    Async HTTP client for graph.mapillary.com and Nominatim. One keep-alive
+    connection pool is shared by every request, so only the first request to
+    a host pays the TCP and TLS handshake. Requests without an explicit
+    timeout use the timeout configured for their endpoint.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        **retry_options,
+        ) -> None:
+        super().__init__(**retry_options)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+    async def get(
+        self,
+        url: str,
+        params: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+        timeout: Optional[float] = None,
+        ) -> httpx.Response:
+        """
+        GET with retries. Returns the last response once retries are exhausted,
+        so callers keep checking status_code; raises the last connection error.
+        """
+        client = self._get_client()
+        timeout = self._timeout(url, timeout)
+        attempt = 0
+        while True:
+            try:
+                response = await client.get(url, params=params, headers=headers, timeout=timeout)
+            except httpx.TransportError as e:
+                if not self._should_retry(attempt, None):
+                    raise
+                delay = self._delay(attempt)
+                self._log_retry(url, attempt, type(e).__name__, delay)
+            else:
+                if not self._should_retry(attempt, response.status_code):
+                    return response
+                delay = self._delay(attempt, response.headers.get("Retry-After"))
+                self._log_retry(url, attempt, f"HTTP {response.status_code}", delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+    async def pages(self, url: str, params: Optional[Dict] = None, max_pages: int = MAPILLARY_MAX_PAGES) -> AsyncIterator[List[Dict]]:
+        """
+        Yields the `data` of each result page, following the paging.next cursor
+        of the Graph API. Stops after the last page or the first failed one.
+        """
+        for _ in range(max_pages):
+            response = await self.get(url, params=params)
+            if response.status_code != 200:
+                return
+            body = response.json()
+            yield body.get("data", [])
+            url = body.get("paging", {}).get("next")
+            if not url:
+                return
+            # The next URL already holds the query, cursor included
+            params = None
+
+
+    async def harvest(
+        self,
+        url: str,
+        params: Dict,
+        accept: PageFilter,
+        needed: int,
+        max_pages: int = MAPILLARY_MAX_PAGES,
+        ) -> AsyncIterator[Dict]:
+        """
+        Yields the candidates of each page that pass `accept`, requesting the next page
+        only when the previous ones did not give `needed` candidates. Consumers that
+        stop iterating early stop the requests too.
+        """
+        harvested = 0
+        async for page in self.pages(url, params, max_pages):
+            for item in accept(page):
+                yield item
+                harvested += 1
+                if harvested >= needed:
+                    return
+
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Pooled connections belong to the event loop that opened them, so scripts
+        # calling asyncio.run more than once get a fresh pool per loop
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(limits=self._limits, headers={"User-Agent": NOMINATIM_USER_AGENT})
+            self._loop = loop
+        return self._client
+
+
+class MapillarySession(_RetryPolicy):
+    """Blocking counterpart of MapillaryClient on a pooled requests.Session."""
+
+    def __init__(
+        self,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        **retry_options,
+        ) -> None:
+        super().__init__(**retry_options)
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = NOMINATIM_USER_AGENT
+        # Retries are ours, with jitter, rather than urllib3's
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max_connections, max_retries=0)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+
+    def get(
+        self,
+        url: str,
+        params: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+        timeout: Optional[float] = None,
+        ) -> requests.Response:
+        timeout = self._timeout(url, timeout)
+        attempt = 0
+        while True:
+            try:
+                response = self._session.get(url, params=params, headers=headers, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not self._should_retry(attempt, None):
+                    raise
+                delay = self._delay(attempt)
+                self._log_retry(url, attempt, type(e).__name__, delay)
+            else:
+                if not self._should_retry(attempt, response.status_code):
+                    return response
+                delay = self._delay(attempt, response.headers.get("Retry-After"))
+                self._log_retry(url, attempt, f"HTTP {response.status_code}", delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+    def pages(self, url: str, params: Optional[Dict] = None, max_pages: int = MAPILLARY_MAX_PAGES) -> Iterator[List[Dict]]:
+        """Blocking counterpart of MapillaryClient.pages."""
+        for _ in range(max_pages):
+            response = self.get(url, params=params)
+            if response.status_code != 200:
+                return
+            body = response.json()
+            yield body.get("data", [])
+            url = body.get("paging", {}).get("next")
+            if not url:
+                return
+            params = None
+
+
+    def harvest(
+        self,
+        url: str,
+        params: Dict,
+        accept: PageFilter,
+        needed: int,
+        max_pages: int = MAPILLARY_MAX_PAGES,
+        ) -> Iterator[Dict]:
+        """Blocking counterpart of MapillaryClient.harvest."""
+        harvested = 0
+        for page in self.pages(url, params, max_pages):
+            for item in accept(page):
+                yield item
+                harvested += 1
+                if harvested >= needed:
+                    return
+
+
+    def close(self) -> None:
+        self._session.close()
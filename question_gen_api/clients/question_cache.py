@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+from botocore.exceptions import ClientError
+
+from clients.s3_client import AWSS3Client
+from shared.cache import LRUCache
+from shared.prompts import QUESTION_PROMPT_VERSION
+from shared.constants import (
+    S3_BUCKET_NAME,
+    QUESTION_CACHE_MAX_SIZE,
+    QUESTION_CACHE_TTL_SECONDS,
+    QUESTION_CACHE_S3_PREFIX,
+    QUESTION_CACHE_SQLITE_PATH,
+    QuestionCacheBackend,
+)
+
+
+def image_key(image_url: str) -> str:
+    """Identity of a Mapillary thumbnail: its URL is signed and served from varying CDN edge hosts, only the path is stable."""
+    return urlsplit(image_url).path
+
+
+def question_cache_key(image_url: str, city: Optional[str], prompt_version: int = QUESTION_PROMPT_VERSION) -> str:
+    image_id = image_key(image_url)
+    city = " ".join((city or "").split()).casefold()
+    return hashlib.sha256(f"{image_id}|{city}|{prompt_version}".encode("utf-8")).hexdigest()
+
+
+class QuestionCache(ABC):
+    """
+    Generated questions per cache key, kept as a list of variants so that a
+    repeated image can still get one of several different questions.
+    A variant is {content, result}: the raw model answer and the parsed question.
+    """
+
+    def __init__(self, ttl_seconds: float = QUESTION_CACHE_TTL_SECONDS) -> None:
+        self._ttl_seconds = ttl_seconds
+
+
+    async def get(self, key: str) -> List[Dict]:
+        now = time.time()
+        return [variant for variant in await self._read(key) if now - variant["cached_at"] < self._ttl_seconds]
+
+
+    async def add(self, key: str, variant: Dict, max_variants: int) -> None:
+        """Adds a variant, dropping the oldest ones beyond `max_variants`."""
+        variants = await self.get(key)
+        variants.append({**variant, "cached_at": time.time()})
+        await self._write(key, variants[-max_variants:])
+
+
+    @abstractmethod
+    async def _read(self, key: str) -> List[Dict]:
+        """All stored variants of the key, expired ones included."""
+
+    @abstractmethod
+    async def _write(self, key: str, variants: List[Dict]) -> None:
+        """Replaces the variants of the key."""
+
+
+class LocalQuestionCache(QuestionCache):
+    """In-process cache, lost on restart and not shared between Lambda instances."""
+
+    def __init__(self, max_size: int = QUESTION_CACHE_MAX_SIZE, ttl_seconds: float = QUESTION_CACHE_TTL_SECONDS) -> None:
+        super().__init__(ttl_seconds)
+        self._entries = LRUCache(max_size=max_size, ttl_seconds=ttl_seconds)
+
+    async def _read(self, key: str) -> List[Dict]:
+        return list(self._entries.get(key, []))
+
+    async def _write(self, key: str, variants: List[Dict]) -> None:
+        self._entries.set(key, variants)
+
+
+class SQLiteQuestionCache(QuestionCache):
+
+    def __init__(self, db_path: str = QUESTION_CACHE_SQLITE_PATH, ttl_seconds: float = QUESTION_CACHE_TTL_SECONDS) -> None:
+        super().__init__(ttl_seconds)
+        self._db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS question_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL
+                )
+                """
+            )
+
+    async def _read(self, key: str) -> List[Dict]:
+        return await asyncio.to_thread(self._read_sync, key)
+
+    async def _write(self, key: str, variants: List[Dict]) -> None:
+        await asyncio.to_thread(self._write_sync, key, json.dumps(variants))
+
+    def _read_sync(self, key: str) -> List[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT payload FROM question_cache WHERE cache_key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _write_sync(self, key: str, payload: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO question_cache (cache_key, payload) VALUES (?, ?)",
+                (key, payload),
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self._db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+class S3QuestionCache(QuestionCache):
+    """Shared between all instances, one object per key under the cache prefix."""
+
+    def __init__(
+        self,
+        s3_client: AWSS3Client,
+        bucket_name: str = S3_BUCKET_NAME,
+        prefix: str = QUESTION_CACHE_S3_PREFIX,
+        ttl_seconds: float = QUESTION_CACHE_TTL_SECONDS,
+        ) -> None:
+        super().__init__(ttl_seconds)
+        self._s3_client = s3_client
+        self._bucket_name = bucket_name
+        self._prefix = prefix
+
+    async def _read(self, key: str) -> List[Dict]:
+        try:
+            payload = await self._s3_client.read_file_async(bucket_name=self._bucket_name, object_key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return []
+            raise
+        return json.loads(payload.read().decode('utf-8'))
+
+    async def _write(self, key: str, variants: List[Dict]) -> None:
+        await self._s3_client.write_file_async(
+            bucket_name=self._bucket_name,
+            object_key=self._object_key(key),
+            byte_reader=json.dumps(variants).encode('utf-8')
+        )
+
+    def _object_key(self, key: str) -> str:
+        return f"{self._prefix}{key}.json"
+
+
+def create_question_cache(backend: QuestionCacheBackend, s3_client: Optional[AWSS3Client] = None, path: Optional[str] = None) -> QuestionCache:
+    if backend == QuestionCacheBackend.LOCAL:
+        return LocalQuestionCache()
+    if backend == QuestionCacheBackend.SQLITE:
+        return SQLiteQuestionCache(path or QUESTION_CACHE_SQLITE_PATH)
+    if backend == QuestionCacheBackend.S3:
+        if s3_client is None:
+            raise ValueError("The S3 question cache needs an s3_client")
+        return S3QuestionCache(s3_client)
+    raise ValueError(f"Unknown question cache backend {backend}")
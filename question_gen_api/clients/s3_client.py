@@ -1,3 +1,4 @@
+import asyncio
 import boto3
 import os
 import io
@@ -61,6 +62,36 @@ class AWSS3Client:
             raise RuntimeError(f"Error writing file: {e}")
 
 
+    def delete_files(self, bucket_name, object_keys):
+        self.role_refresh_middleware()
+        try:
+            # delete_objects accepts at most 1000 keys per request
+            for start in range(0, len(object_keys), 1000):
+                self.s3.delete_objects(
+                    Bucket=bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in object_keys[start:start + 1000]], "Quiet": True},
+                )
+        except (BotoCoreError, NoCredentialsError) as e:
+            raise RuntimeError(f"Error deleting objects: {e}")
+
+
+    async def list_folder_objects_async(self, bucket_name, folder_path):
+        return await asyncio.to_thread(self.list_folder_objects, bucket_name, folder_path)
+
+
+    async def delete_files_async(self, bucket_name, object_keys):
+        return await asyncio.to_thread(self.delete_files, bucket_name, object_keys)
+
+
+    async def read_file_async(self, bucket_name, object_key):
+        # boto3 is blocking, run it on the default executor to keep the event loop free
+        return await asyncio.to_thread(self.read_file, bucket_name, object_key)
+
+
+    async def write_file_async(self, bucket_name, object_key, byte_reader):
+        return await asyncio.to_thread(self.write_file, bucket_name, object_key, byte_reader)
+
+
     def role_refresh_middleware(self):
         if self.role_assumer and self.role_assumer.needs_refresh():
             self.role_assumer.rotate_credentials()
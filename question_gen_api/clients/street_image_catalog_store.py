@@ -0,0 +1,88 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class StreetImageCatalogStore:
+    """SQLite file holding the pre-scored Mapillary candidates of each city."""
+
+    def __init__(self, db_path: str) -> None:
+        self._db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS street_images (
+                    city TEXT NOT NULL,
+                    image_id TEXT NOT NULL,
+                    image_url TEXT NOT NULL,
+                    score REAL NOT NULL,
+                    has_traffic_sign INTEGER NOT NULL,
+                    has_infrastructure INTEGER NOT NULL,
+                    has_vehicle INTEGER NOT NULL,
+                    captured_at INTEGER,
+                    PRIMARY KEY (city, image_id)
+                );
+                CREATE TABLE IF NOT EXISTS catalog_builds (
+                    city TEXT PRIMARY KEY,
+                    built_at REAL NOT NULL,
+                    image_count INTEGER NOT NULL
+                );
+                """
+            )
+
+
+    def replace_city(self, city: str, images: List[Dict]) -> None:
+        """Atomically swaps the catalog of a city for a freshly scraped one."""
+        rows = [
+            (
+                city,
+                str(img["image_id"]),
+                img["image_url"],
+                float(img["score"]),
+                int(img["has_traffic_sign"]),
+                int(img["has_infrastructure"]),
+                int(img["has_vehicle"]),
+                img.get("captured_at"),
+            )
+            for img in images
+        ]
+        with self._connect() as conn:
+            conn.execute("DELETE FROM street_images WHERE city = ?", (city,))
+            conn.executemany("INSERT OR REPLACE INTO street_images VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog_builds VALUES (?, ?, ?)",
+                (city, time.time(), len(rows)),
+            )
+
+
+    def update_image_url(self, city: str, image_id: str, image_url: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE street_images SET image_url = ? WHERE city = ? AND image_id = ?",
+                (image_url, city, str(image_id)),
+            )
+
+
+    def load_city(self, city: str) -> List[Dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("SELECT * FROM street_images WHERE city = ?", (city,)).fetchall()
+        return [dict(row) for row in rows]
+
+
+    def built_at(self, city: str) -> Optional[float]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT built_at FROM catalog_builds WHERE city = ?", (city,)).fetchone()
+        return row[0] if row else None
+
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self._db_path, timeout=30)
+        try:
+            # Commits on success and rolls back on error
+            with conn:
+                yield conn
+        finally:
+            conn.close()
@@ -0,0 +1,439 @@
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, List, Sequence, Tuple, AsyncIterator
+
+import numpy as np
+from upstash_vector import AsyncIndex, Vector
+
+from shared.rate_limiter import TokenBucketRateLimiter
+from shared.constants import (
+    UPSTASH_RATE_PER_SECOND,
+    UPSTASH_BURST,
+    INDEX_SCAN_BATCH_SIZE,
+    LOCAL_INDEX_APPROXIMATE_MIN_ROWS,
+    LOCAL_INDEX_N_PROBE,
+    LOCAL_INDEX_KMEANS_ITERATIONS,
+)
+
+# (id, vector, metadata)
+IndexVector = Tuple[str, Sequence[float], Dict]
+
+SNAPSHOT_VECTORS_FILE = "vectors.npy"
+SNAPSHOT_METADATA_FILE = "metadata.json"
+
+
+class SearchFilter:
+    """
+    Restricts a search to questions of a city, showing any of the given sign
+    categories and/or created in a time range (unix seconds). Questions indexed
+    without these metadata fields never match a filter on them.
+    """
+
+    def __init__(
+        self,
+        city: Optional[str] = None,
+        sign_categories: Optional[List[str]] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        ) -> None:
+        self.city = city
+        self.sign_categories = list(sign_categories or [])
+        self.created_after = created_after
+        self.created_before = created_before
+
+    def __bool__(self) -> bool:
+        return bool(self.city is not None or self.sign_categories or self.created_after is not None or self.created_before is not None)
+
+    def to_upstash(self) -> str:
+        """Upstash metadata filter expression."""
+        clauses = []
+        if self.city is not None:
+            clauses.append(f"city = {_quote(self.city)}")
+        if self.sign_categories:
+            clauses.append("(" + " OR ".join(f"sign_categories CONTAINS {_quote(category)}" for category in self.sign_categories) + ")")
+        if self.created_after is not None:
+            clauses.append(f"created_at >= {int(self.created_after)}")
+        if self.created_before is not None:
+            clauses.append(f"created_at < {int(self.created_before)}")
+        return " AND ".join(clauses)
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+class VectorIndex(ABC):
+    """Vector store behind the similarity search. Query results are {id, score, metadata} dicts."""
+
+    @abstractmethod
+    async def upsert(self, vectors: List[IndexVector]) -> None:
+        """Adds the vectors, replacing those with an existing id."""
+
+    @abstractmethod
+    async def query(self, vector: Sequence[float], top_k: int, search_filter: Optional[SearchFilter] = None) -> List[Dict]:
+        """The `top_k` most similar vectors matching the filter, best first."""
+
+    @abstractmethod
+    async def delete(self, ids: List[str]) -> None:
+        """Removes the vectors, unknown ids are ignored."""
+
+    @abstractmethod
+    def scan(self, batch_size: int = INDEX_SCAN_BATCH_SIZE) -> AsyncIterator[List[IndexVector]]:
+        """Yields every vector of the index with its metadata, in batches."""
+
+    def stats(self) -> Dict:
+        return {}
+
+
+class UpstashVectorIndex(VectorIndex):
+
+    def __init__(self, url: str, token: str, rate_limiter: Optional[TokenBucketRateLimiter] = None) -> None:
+        self._index = AsyncIndex(url=url, token=token)
+        self._rate_limiter = rate_limiter or TokenBucketRateLimiter(
+            rate_per_second=UPSTASH_RATE_PER_SECOND,
+            capacity=UPSTASH_BURST,
+            name="upstash",
+        )
+
+    async def upsert(self, vectors: List[IndexVector]) -> None:
+        await self._rate_limiter.acquire()
+        await self._index.upsert(
+            vectors=[Vector(id=vector_id, vector=list(vector), metadata=metadata) for vector_id, vector, metadata in vectors]
+        )
+
+    async def query(self, vector: Sequence[float], top_k: int, search_filter: Optional[SearchFilter] = None) -> List[Dict]:
+        await self._rate_limiter.acquire()
+        results = await self._index.query(
+            vector=list(vector),
+            top_k=top_k,
+            include_metadata=True,
+            filter=search_filter.to_upstash() if search_filter else "",
+        )
+        return [{"id": result.id, "score": result.score, "metadata": result.metadata} for result in results]
+
+    async def delete(self, ids: List[str]) -> None:
+        await self._rate_limiter.acquire()
+        await self._index.delete(ids=ids)
+
+    async def scan(self, batch_size: int = INDEX_SCAN_BATCH_SIZE) -> AsyncIterator[List[IndexVector]]:
+        cursor = ""
+        while True:
+            await self._rate_limiter.acquire()
+            page = await self._index.range(
+                cursor=cursor,
+                limit=batch_size,
+                include_vectors=True,
+                include_metadata=True,
+            )
+            if page.vectors:
+                yield [(vector.id, vector.vector, vector.metadata or {}) for vector in page.vectors]
+            cursor = page.next_cursor
+            if not cursor:
+                return
+
+    def stats(self) -> Dict:
+        return self._rate_limiter.stats()
+
+
+class LocalVectorIndex(VectorIndex):
+    """
+    In-process cosine similarity index over unit-normalized float32 vectors.
+
+    Vectors loaded from a snapshot stay memory-mapped; vectors added later go to an
+    in-memory block, and replaced or deleted rows are only masked out. Exact search
+    is one matrix-vector product. The approximate mode clusters the rows with
+    k-means (an inverted file) and only scores the `n_probe` closest clusters plus
+    the rows added since the clusters were built.
+
+    City, sign categories and creation time are also kept as columns (city code,
+    category bitmask, timestamp), so filters are a vectorized mask applied before
+    scoring rather than a post-filter on the results.
+    """
+
+    def __init__(
+        self,
+        snapshot_path: Optional[str] = None,
+        approximate: bool = False,
+        n_lists: Optional[int] = None,
+        n_probe: int = LOCAL_INDEX_N_PROBE,
+        approximate_min_rows: int = LOCAL_INDEX_APPROXIMATE_MIN_ROWS,
+        logger: Optional[logging.Logger] = None,
+        ) -> None:
+        self._approximate = approximate
+        self._n_lists = n_lists
+        self._n_probe = n_probe
+        self._approximate_min_rows = approximate_min_rows
+        self._logger = logger or logging.getLogger(__name__)
+        self._ids: List[str] = []
+        self._metadata: List[Dict] = []
+        self._positions: Dict[str, int] = {}
+        self._base = np.empty((0, 0), dtype=np.float32)
+        self._extra = np.empty((0, 0), dtype=np.float32)
+        self._extra_count = 0
+        self._alive = np.empty(0, dtype=bool)
+        self._city_codes: Dict[str, int] = {}
+        self._category_bits: Dict[str, int] = {}
+        self._cities = np.empty(0, dtype=np.int32)
+        self._categories = np.empty(0, dtype=np.uint64)
+        self._created_at = np.empty(0, dtype=np.float64)
+        self._ivf: Optional[Tuple[np.ndarray, List[np.ndarray], int]] = None
+        if snapshot_path and os.path.exists(os.path.join(snapshot_path, SNAPSHOT_VECTORS_FILE)):
+            self._load(snapshot_path)
+
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+
+    @property
+    def dimension(self) -> int:
+        return self._base.shape[1] or self._extra.shape[1]
+
+
+    async def upsert(self, vectors: List[IndexVector]) -> None:
+        self.add(vectors)
+
+
+    async def query(self, vector: Sequence[float], top_k: int, search_filter: Optional[SearchFilter] = None) -> List[Dict]:
+        return self.search(vector, top_k, search_filter)
+
+
+    async def delete(self, ids: List[str]) -> None:
+        for vector_id in ids:
+            position = self._positions.pop(vector_id, None)
+            if position is not None:
+                self._alive[position] = False
+
+
+    async def scan(self, batch_size: int = INDEX_SCAN_BATCH_SIZE) -> AsyncIterator[List[IndexVector]]:
+        live = np.flatnonzero(self._alive[:self._total_rows()])
+        for start in range(0, len(live), batch_size):
+            rows = live[start:start + batch_size]
+            yield [
+                (self._ids[row], vector, self._metadata[row])
+                for row, vector in zip(rows, self._rows(rows).tolist())
+            ]
+
+
+    def add(self, vectors: List[IndexVector]) -> None:
+        if not vectors:
+            return
+        matrix = self._normalize(np.asarray([vector for _, vector, _ in vectors], dtype=np.float32))
+        if self.dimension and matrix.shape[1] != self.dimension:
+            raise ValueError(f"Expected vectors of dimension {self.dimension}, got {matrix.shape[1]}")
+        self._reserve(len(vectors), matrix.shape[1])
+        start = self._total_rows()
+        self._extra[self._extra_count:self._extra_count + len(vectors)] = matrix
+        self._extra_count += len(vectors)
+        self._alive[start:start + len(vectors)] = True
+        for offset, (vector_id, _, metadata) in enumerate(vectors):
+            previous = self._positions.get(vector_id)
+            if previous is not None:
+                self._alive[previous] = False
+            self._positions[vector_id] = start + offset
+            self._ids.append(vector_id)
+            self._metadata.append(metadata)
+            self._set_columns(start + offset, metadata)
+
+
+    def search(self, vector: Sequence[float], top_k: int, search_filter: Optional[SearchFilter] = None) -> List[Dict]:
+        if not self._positions or top_k <= 0:
+            return []
+        query = self._normalize(np.asarray(vector, dtype=np.float32)[None, :])[0]
+        total = self._total_rows()
+        mask = self._mask(search_filter, total)
+        if self._approximate and total >= self._approximate_min_rows:
+            rows = self._candidate_rows(query)
+            rows = rows[mask[rows]]
+            if len(rows) < top_k:
+                # Selective filter: the probed clusters hold too few matches, score all matches instead
+                rows = np.flatnonzero(mask)
+        elif search_filter:
+            rows = np.flatnonzero(mask)
+        else:
+            rows = None
+
+        if rows is None:
+            scores = np.concatenate([block @ query for block in (self._base, self._extra[:self._extra_count]) if len(block)])
+            scores = np.where(mask, scores, -np.inf)
+        elif len(rows):
+            scores = self._rows(rows) @ query
+        else:
+            return []
+
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        results = []
+        for i in best:
+            if scores[i] == -np.inf:
+                break
+            position = int(rows[i]) if rows is not None else int(i)
+            results.append({"id": self._ids[position], "score": float(scores[i]), "metadata": self._metadata[position]})
+        return results
+
+
+    def save(self, path: str) -> None:
+        """Writes the live vectors as a snapshot directory, memory-mapped by LocalVectorIndex(snapshot_path)."""
+        live = np.flatnonzero(self._alive[:self._total_rows()])
+        os.makedirs(path, exist_ok=True)
+        vectors_path = os.path.join(path, SNAPSHOT_VECTORS_FILE)
+        metadata_path = os.path.join(path, SNAPSHOT_METADATA_FILE)
+        with open(f"{vectors_path}.tmp", "wb") as f:
+            np.save(f, self._rows(live) if len(live) else np.empty((0, self.dimension), dtype=np.float32))
+        with open(f"{metadata_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "ids": [self._ids[i] for i in live],
+                "metadata": [self._metadata[i] for i in live],
+            }, f)
+        os.replace(f"{vectors_path}.tmp", vectors_path)
+        os.replace(f"{metadata_path}.tmp", metadata_path)
+        self._logger.info(f"Saved {len(live)} vectors to {path}")
+
+
+    def stats(self) -> Dict:
+        return {
+            "vectors": len(self._positions),
+            "rows": self._total_rows(),
+            "mapped_rows": len(self._base),
+            "approximate": self._approximate,
+            "clusters": len(self._ivf[1]) if self._ivf else 0,
+        }
+
+
+    def _load(self, path: str) -> None:
+        self._base = np.load(os.path.join(path, SNAPSHOT_VECTORS_FILE), mmap_mode="r")
+        with open(os.path.join(path, SNAPSHOT_METADATA_FILE), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        self._ids = list(metadata["ids"])
+        self._metadata = list(metadata["metadata"])
+        self._positions = {vector_id: i for i, vector_id in enumerate(self._ids)}
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._cities = np.full(len(self._ids), -1, dtype=np.int32)
+        self._categories = np.zeros(len(self._ids), dtype=np.uint64)
+        self._created_at = np.full(len(self._ids), np.nan)
+        for position, row_metadata in enumerate(self._metadata):
+            self._set_columns(position, row_metadata)
+        self._logger.info(f"Loaded {len(self._ids)} vectors from {path}")
+
+
+    def _total_rows(self) -> int:
+        return len(self._base) + self._extra_count
+
+
+    def _reserve(self, count: int, dimension: int) -> None:
+        needed = self._extra_count + count
+        if needed > len(self._extra) or self._extra.shape[1] != dimension:
+            capacity = max(needed, 2 * len(self._extra), 64)
+            extra = np.empty((capacity, dimension), dtype=np.float32)
+            if self._extra_count:
+                extra[:self._extra_count] = self._extra[:self._extra_count]
+            self._extra = extra
+        total = len(self._base) + needed
+        if total > len(self._alive):
+            capacity = max(total, 2 * len(self._alive), 64)
+            self._alive = self._grow(self._alive, capacity, False)
+            self._cities = self._grow(self._cities, capacity, -1)
+            self._categories = self._grow(self._categories, capacity, 0)
+            self._created_at = self._grow(self._created_at, capacity, np.nan)
+
+
+    @staticmethod
+    def _grow(column: np.ndarray, capacity: int, fill) -> np.ndarray:
+        grown = np.full(capacity, fill, dtype=column.dtype)
+        grown[:len(column)] = column
+        return grown
+
+
+    def _set_columns(self, position: int, metadata: Dict) -> None:
+        city = metadata.get("city")
+        if city is not None:
+            self._cities[position] = self._city_codes.setdefault(city, len(self._city_codes))
+        bits = 0
+        for category in metadata.get("sign_categories") or []:
+            bit = self._category_bits.get(category)
+            if bit is None:
+                if len(self._category_bits) >= 64:
+                    raise ValueError("The local index supports at most 64 sign categories")
+                bit = self._category_bits[category] = len(self._category_bits)
+            bits |= 1 << bit
+        self._categories[position] = bits
+        created_at = metadata.get("created_at")
+        if created_at is not None:
+            self._created_at[position] = created_at
+
+
+    def _mask(self, search_filter: Optional[SearchFilter], total: int) -> np.ndarray:
+        mask = self._alive[:total].copy()
+        if not search_filter:
+            return mask
+        if search_filter.city is not None:
+            code = self._city_codes.get(search_filter.city)
+            if code is None:
+                return np.zeros(total, dtype=bool)
+            mask &= self._cities[:total] == code
+        if search_filter.sign_categories:
+            bits = 0
+            for category in search_filter.sign_categories:
+                if category in self._category_bits:
+                    bits |= 1 << self._category_bits[category]
+            mask &= (self._categories[:total] & np.uint64(bits)) != 0
+        # NaN (no creation time) compares false, so those rows never match a time filter
+        if search_filter.created_after is not None:
+            mask &= self._created_at[:total] >= search_filter.created_after
+        if search_filter.created_before is not None:
+            mask &= self._created_at[:total] < search_filter.created_before
+        return mask
+
+
+    def _rows(self, rows: np.ndarray) -> np.ndarray:
+        base_count = len(self._base)
+        in_base = rows < base_count
+        if in_base.all():
+            return self._base[rows]
+        if not in_base.any():
+            return self._extra[rows - base_count]
+        out = np.empty((len(rows), self.dimension), dtype=np.float32)
+        out[in_base] = self._base[rows[in_base]]
+        out[~in_base] = self._extra[rows[~in_base] - base_count]
+        return out
+
+
+    def _candidate_rows(self, query: np.ndarray) -> np.ndarray:
+        total = self._total_rows()
+        # Rebuild once the index has doubled, rows added in between are always scanned
+        if self._ivf is None or total >= 2 * self._ivf[2]:
+            self._ivf = self._build_ivf(total)
+        centroids, lists, built_rows = self._ivf
+        n_probe = min(self._n_probe, len(lists))
+        probe = np.argpartition(-(centroids @ query), n_probe - 1)[:n_probe]
+        return np.concatenate([lists[i] for i in probe] + [np.arange(built_rows, total)])
+
+
+    def _build_ivf(self, total: int) -> Tuple[np.ndarray, List[np.ndarray], int]:
+        rows = np.flatnonzero(self._alive[:total])
+        matrix = self._rows(rows)
+        n_lists = min(self._n_lists or max(1, int(np.sqrt(len(rows)))), len(rows))
+        rng = np.random.default_rng(0)
+        centroids = matrix[rng.choice(len(rows), n_lists, replace=False)]
+        for _ in range(LOCAL_INDEX_KMEANS_ITERATIONS):
+            assignment = np.argmax(matrix @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, matrix)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = self._normalize(sums)
+        assignment = np.argmax(matrix @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+        lists = [rows[order[bounds[i]:bounds[i + 1]]] for i in range(n_lists)]
+        self._logger.info(f"Built {n_lists} clusters over {len(rows)} vectors")
+        return centroids, lists, total
+
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
@@ -1,30 +1,61 @@
+import asyncio
 import logging
+import random
 import uuid
-import json
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, List, AsyncIterator
 from mistralai import Mistral
-from clients.s3_client import AWSS3Client
+from clients.chat_store import ChatStore
+from clients.question_cache import QuestionCache, question_cache_key
 from shared.prompts import DRIVING_EXAM_CHAT_SYSTEM_PROMPT, DRIVING_EXAM_CHAT_SYSTEM_PROMPT_FOLLOW_UP, DRIVING_EXAM_CHAT_USER_PROMPT
-from shared.constants import MISTRAL_IMAGE_TEXT_MODEL
+from shared.cache import LRUCache
+from shared.context_window import ContextWindow
+from shared.question_parser import QuestionGenerationError, QuestionParseError, message_text, parse_question
+from shared.constants import MISTRAL_IMAGE_TEXT_MODEL, CHAT_CACHE_MAX_SIZE, CHAT_CACHE_TTL_SECONDS, CHAT_COMPACTION_SEGMENTS, QUESTION_PARSE_MAX_ATTEMPTS, QUESTION_CACHE_VARIANTS, ChatPersistenceMode
 
 class DrivingExamChatController:
 
-    def __init__(self, mistral_client: Mistral, s3_client: AWSS3Client, logger: Optional[logging.Logger] = None) -> None:
+    def __init__(
+        self,
+        mistral_client: Mistral,
+        chat_store: ChatStore,
+        logger: Optional[logging.Logger] = None,
+        chat_cache_max_size: int = CHAT_CACHE_MAX_SIZE,
+        chat_cache_ttl_seconds: float = CHAT_CACHE_TTL_SECONDS,
+        persistence_mode: ChatPersistenceMode = ChatPersistenceMode.WRITE_THROUGH,
+        compaction_segments: int = CHAT_COMPACTION_SEGMENTS,
+        question_parse_attempts: int = QUESTION_PARSE_MAX_ATTEMPTS,
+        question_cache: Optional[QuestionCache] = None,
+        question_cache_variants: int = QUESTION_CACHE_VARIANTS,
+        context_window: Optional[ContextWindow] = None,
+        ) -> None:
+        if question_parse_attempts < 1:
+            raise ValueError("question_parse_attempts must be at least 1")
         self._mistral_client = mistral_client
-        self._s3_client = s3_client
+        self._persistence_mode = persistence_mode
+        self._chat_store = chat_store
+        self._compaction_segments = compaction_segments
+        self._question_parse_attempts = question_parse_attempts
+        self._question_cache = question_cache
+        self._question_cache_variants = question_cache_variants
+        # None sends the whole chat with every follow-up question
+        self._context_window = context_window
         self._logger = logger or logging.getLogger(__name__)
-        self._active_chats = {}
+        self._active_chats = LRUCache(
+            max_size=chat_cache_max_size,
+            ttl_seconds=chat_cache_ttl_seconds,
+            on_evict=self._on_chat_evicted,
+        )
+        # Write-backs of evicted chats still running, with the chat they save
+        self._write_backs: Dict[str, tuple] = {}
 
     
 
-    def generate_driving_questions_for_image(self, image_url: str, chat_id: Optional[str] = None, city: Optional[str] = "Paris") -> Dict:
+    async def generate_driving_questions_for_image(self, image_url: str, chat_id: Optional[str] = None, city: Optional[str] = "Paris") -> Dict:
         if not chat_id:
-            chat_id = self._generate_chat_id()
-        else:
-            self._download_chat_history(chat_id)
+            chat_id = await self._generate_chat_id()
+        chat = await self._get_chat(chat_id)
         system_messages = DRIVING_EXAM_CHAT_SYSTEM_PROMPT % (city)
-        chat = self._active_chats[chat_id]
         chat["messages"].append({
             "role": "user",
             "content": [
@@ -38,128 +69,269 @@ class DrivingExamChatController:
                 },
             ]
         })
-        response = self._mistral_client.chat.complete(
-            model="pixtral-12b-2409",
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_messages,
-                },
-                *chat["messages"],
-            ],
-        )
-        self._active_chats[chat_id]["messages"].append({
+        # Only questions for a fresh chat are cached, later ones depend on the conversation so far
+        cache_key = question_cache_key(image_url, city) if self._question_cache and len(chat["messages"]) == 1 else None
+        cached = await self._cached_question(cache_key)
+        if cached:
+            chat["messages"].append({
+                "role": "assistant",
+                "content": cached["content"],
+            })
+            await self._persist_turn(chat_id, chat)
+            self._logger.info(f"Served cached driving questions for image {image_url} in chat {chat_id}")
+            return chat_id, dict(cached["result"])
+
+        request_messages = [
+            {
+                "role": "system",
+                "content": system_messages,
+            },
+            *chat["messages"],
+        ]
+        result = None
+        for attempt in range(1, self._question_parse_attempts + 1):
+            response = await self._mistral_client.chat.complete_async(
+                model=MISTRAL_IMAGE_TEXT_MODEL,
+                messages=request_messages,
+                response_format={"type": "json_object"},
+            )
+            content = message_text(response.choices[0].message.content)
+            try:
+                result = parse_question(content)
+                break
+            except QuestionParseError as e:
+                self._logger.warning(f"Unusable question for image {image_url} (attempt {attempt}/{self._question_parse_attempts}): {e}")
+        if result is None:
+            # Keep the chat as it was, the image turn is not persisted without a question
+            chat["messages"].pop()
+            self._logger.error(f"No usable question generated for image {image_url} in chat {chat_id}")
+            raise QuestionGenerationError(f"No usable question generated for image {image_url}")
+        chat["messages"].append({
             "role": "assistant",
-            "content": response.model_dump()["choices"][0]["message"]["content"],
+            "content": content,
         })
-        self._save_chat_history(chat_id)
+        await self._persist_turn(chat_id, chat)
         self._logger.info(f"Generated driving questions for image {image_url} in chat {chat_id}")
-
-        try:
-            question_parsed = json.loads('{' + response.model_dump()["choices"][0]["message"]["content"].split('{')[1].split('}')[0] + '}')
-            correct_answer = question_parsed.get("correct_answer", 1)
-            try:
-                correct_answer = int(correct_answer)
-            except ValueError:
-                #lookup index of correct answer in answers list
-                answers = question_parsed.get("answers", [])
-                if correct_answer in answers:
-                    correct_answer = answers.index(correct_answer)
-                if correct_answer == -1:
-                    correct_answer = 1
-            result = {
-                "question": question_parsed.get("question", ""),
-                "answers": question_parsed.get("answers", []),
-                "explanation": question_parsed.get("explanation", ""),
-                "correct_answer": correct_answer,
-
-            }
-        except json.JSONDecodeError as e:
-            result = {
-                "question": "",
-                "answers": [],
-                "explanation": "",
-                "correct_answer": "",
-            }
+        await self._cache_question(cache_key, content, result)
         return chat_id, result
 
 
-    def ask_followup_question(self, question: str, chat_id: Optional[str] = None) -> str:
+    async def ask_followup_question(self, question: str, chat_id: Optional[str] = None) -> str:
         if not chat_id:
-            chat_id = self._generate_chat_id()
-        else:
-            self._download_chat_history(chat_id)
-        chat = self._active_chats[chat_id]
+            chat_id = await self._generate_chat_id()
+        chat = await self._get_chat(chat_id)
         chat["messages"].append({
             "role": "user",
             "content": question
         })
-        system_messages = DRIVING_EXAM_CHAT_SYSTEM_PROMPT_FOLLOW_UP
-        response = self._mistral_client.chat.complete(
-            model="pixtral-12b-2409",
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_messages,
-                },
-                *chat["messages"],
-            ],
+        response = await self._mistral_client.chat.complete_async(
+            model=MISTRAL_IMAGE_TEXT_MODEL,
+            messages=self._followup_messages(chat),
         )
+        result = message_text(response.choices[0].message.content)
         chat["messages"].append({
             "role": "assistant",
-            "content": response.model_dump()["choices"][0]["message"]["content"],
+            "content": result,
         })
-        self._save_chat_history(chat_id)
+        await self._persist_turn(chat_id, chat)
         self._logger.info(f"Asked question in chat {chat_id}: {question}")
-        result = response.model_dump()["choices"][0]["message"]["content"]
         return result
 
 
+    async def stream_followup_question(self, question: str, chat_id: str) -> AsyncIterator[str]:
+        """
+        Same as ask_followup_question, but yields the answer in chunks as Mistral produces them.
+        The turn is only added to the chat history once the stream has completed.
+        """
+        chat = await self._get_chat(chat_id)
+        question_index = len(chat["messages"])
+        chat["messages"].append({
+            "role": "user",
+            "content": question
+        })
+        answer_parts = []
+        try:
+            response = await self._mistral_client.chat.stream_async(
+                model=MISTRAL_IMAGE_TEXT_MODEL,
+                messages=self._followup_messages(chat),
+            )
+            async with response as events:
+                async for event in events:
+                    delta = event.data.choices[0].delta.content
+                    if isinstance(delta, str) and delta:
+                        answer_parts.append(delta)
+                        yield delta
+        except BaseException:
+            # Failed or abandoned by the client: forget the unanswered question unless it was already saved
+            if chat["persisted_count"] <= question_index:
+                del chat["messages"][question_index:]
+            raise
+        chat["messages"].append({
+            "role": "assistant",
+            "content": "".join(answer_parts),
+        })
+        await self._persist_turn(chat_id, chat)
+        self._logger.info(f"Streamed answer to question in chat {chat_id}: {question}")
+
 
-    def _generate_chat_id(self):
+
+    def cache_stats(self) -> Dict:
+        return self._active_chats.stats()
+
+
+    async def flush_chat_history(self, chat_id: str) -> None:
+        """Saves a chat if it has turns that are not persisted yet (deferred persistence mode)."""
+        chat = self._active_chats.get(chat_id)
+        if chat and self._is_dirty(chat):
+            await self._save_chat_history(chat_id, chat)
+
+
+    async def _cached_question(self, cache_key: Optional[str]) -> Optional[Dict]:
+        if not cache_key:
+            return None
+        try:
+            variants = await self._question_cache.get(cache_key)
+        except Exception as e:
+            self._logger.error(f"Reading question cache failed: {e}")
+            return None
+        # Keep generating until the key has its full set of variants
+        if len(variants) < self._question_cache_variants:
+            return None
+        return random.choice(variants)
+
+
+    async def _cache_question(self, cache_key: Optional[str], content: str, result: Dict) -> None:
+        if not cache_key:
+            return
+        try:
+            await self._question_cache.add(
+                cache_key,
+                {"content": content, "result": result},
+                max_variants=self._question_cache_variants,
+            )
+        except Exception as e:
+            self._logger.error(f"Writing question cache failed: {e}")
+
+
+    def _followup_messages(self, chat: Dict) -> List[Dict]:
+        system_messages = DRIVING_EXAM_CHAT_SYSTEM_PROMPT_FOLLOW_UP
+        messages = chat["messages"]
+        if self._context_window:
+            messages = self._context_window.select(messages, system_prompt=system_messages)
+        return [
+            {
+                "role": "system",
+                "content": system_messages,
+            },
+            *messages,
+        ]
+
+
+    async def _get_chat(self, chat_id: str) -> Dict:
+        # A cached chat is authoritative, only go to S3 on a miss
+        chat = self._active_chats.get(chat_id)
+        if chat is None and chat_id in self._write_backs:
+            # Evicted while unsaved: the chat in memory is newer than the stored one
+            task, chat = self._write_backs[chat_id]
+            await asyncio.gather(asyncio.shield(task), return_exceptions=True)
+            self._active_chats.set(chat_id, chat)
+        if chat is None:
+            chat = await self._download_chat_history(chat_id)
+        if chat is None:
+            raise KeyError(f"Unknown chat {chat_id}")
+        return chat
+
+
+    async def _generate_chat_id(self):
         chat_id = str(uuid.uuid4())
-        self._active_chats[chat_id] = {
+        chat = {
             "created_at": datetime.now(),
             "messages": [],
+            "persisted_count": 0,
+            "segments": 0,
         }
-        self._save_chat_history(chat_id)
+        # Not saved here, the first turn persists the chat together with its messages
+        self._active_chats.set(chat_id, chat)
         return chat_id
 
 
-    def _download_chat_history(self, chat_id: str):
+    async def _download_chat_history(self, chat_id: str) -> Optional[Dict]:
         self._logger.info(f"Downloading chat history for chat {chat_id}")
         try:
-            chat_data = self._s3_client.read_file(
-                bucket_name="hackathon-ai-tech",
-                object_key=f"chats/driving_exam/{chat_id}.json"
-            )
-            chat_data = json.loads(chat_data.read().decode('utf-8'))
-            self._active_chats[chat_id] = {
-                "created_at": datetime.fromisoformat(chat_data["created_at"]),
-                "messages": chat_data["messages"],
+            history = await self._chat_store.load(chat_id)
+            if history is None:
+                self._logger.error(f"No chat history found for {chat_id}")
+                return None
+            messages = history.messages
+            chat = {
+                "created_at": datetime.fromisoformat(history.created_at),
+                "messages": messages,
+                "persisted_count": len(messages),
+                "segments": history.segment_count,
             }
+            self._active_chats.set(chat_id, chat)
             self._logger.info(f"Chat history for {chat_id} downloaded successfully.")
+            return chat
         except Exception as e:
             self._logger.error(f"Failed to download chat history for {chat_id}: {e}")
+            return None
 
 
-    def _save_chat_history(self, chat_id: str):
+    async def _save_chat_history(self, chat_id: str, chat: Dict):
+        # Only the messages added since the last save are written, as a new segment
+        first_index = chat["persisted_count"]
+        new_messages = chat["messages"][first_index:]
+        if not new_messages:
+            return
         self._logger.info(f"Saving chat history for chat {chat_id}")
-        chat = self._active_chats.get(chat_id)
-        if not chat:
-            self._logger.warning(f"No chat found with ID {chat_id}")
+        await self._chat_store.append(chat_id, chat["created_at"].isoformat(), first_index, new_messages)
+        chat["persisted_count"] = first_index + len(new_messages)
+        chat["segments"] += 1
+        if chat["segments"] >= self._compaction_segments:
+            await self._compact_chat_history(chat_id, chat)
+        self._logger.info(f"Chat history for {chat_id} saved successfully.")
+
+
+    async def _compact_chat_history(self, chat_id: str, chat: Dict):
+        try:
+            await self._chat_store.compact(chat_id)
+            chat["segments"] = 1
+        except Exception as e:
+            # Not fatal, the segments stay readable and compaction is retried on the next save
+            self._logger.error(f"Failed to compact chat history for {chat_id}: {e}")
+
+
+    @staticmethod
+    def _is_dirty(chat: Dict) -> bool:
+        return chat["persisted_count"] < len(chat["messages"])
+
+
+    async def _persist_turn(self, chat_id: str, chat: Dict):
+        if self._persistence_mode == ChatPersistenceMode.WRITE_THROUGH:
+            await self._save_chat_history(chat_id, chat)
+
+
+    def _on_chat_evicted(self, chat_id: str, chat: Dict):
+        # Chats are normally saved every turn, only unsaved ones (e.g. after a failed write) need a write-back
+        if not self._is_dirty(chat):
             return
-        chat_data = {
-            "created_at": chat["created_at"].isoformat(),
-            "messages": chat["messages"],
-        }
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # The cache is only used from coroutines, so this should never happen
+            self._logger.error(f"Evicted chat {chat_id} has unsaved turns but no event loop to write them back")
+            return
+        self._logger.info(f"Writing back evicted chat {chat_id}")
+        task = loop.create_task(self._save_chat_history(chat_id, chat))
+        self._write_backs[chat_id] = (task, chat)
+        task.add_done_callback(lambda task: self._on_write_back_done(chat_id, task))
 
-        self._s3_client.write_file(
-            bucket_name="hackathon-ai-tech",
-            object_key=f"chats/driving_exam/{chat_id}.json",
-            byte_reader=json.dumps(chat_data).encode('utf-8')
-        )
-        self._logger.info(f"Chat history for {chat_id} saved successfully.")
+
+    def _on_write_back_done(self, chat_id: str, task: asyncio.Task):
+        if self._write_backs.get(chat_id, (None,))[0] is task:
+            del self._write_backs[chat_id]
+        if not task.cancelled() and task.exception():
+            self._logger.error(f"Writing back evicted chat {chat_id} failed: {task.exception()}")
 
 
 
@@ -168,6 +340,8 @@ if __name__ == "__main__":
     import os
     load_dotenv(find_dotenv())
     from clients.role_assumer_client import AWSRoleAssumer
+    from clients.s3_client import AWSS3Client
+    from clients.chat_store import S3ChatStore
 
     mistral_api_key = os.getenv("MISTRAL_API_KEY")
     mistral_client = Mistral(api_key=mistral_api_key)
@@ -175,8 +349,8 @@ if __name__ == "__main__":
     role_arn = os.getenv("AWS_ROLE_ARN")
     aws_role_assumer = AWSRoleAssumer(role_arn, rotation_minutes=30)
     s3_client = AWSS3Client(aws_role_assumer)
-    driving_exam_chat_controller = DrivingExamChatController(mistral_client, s3_client)
+    driving_exam_chat_controller = DrivingExamChatController(mistral_client, S3ChatStore(s3_client))
     image_url = "https://scontent-fra5-1.xx.fbcdn.net/m1/v/t6/An8VfU1elhSR-EoNnfkcTtYmbqdsUXLdV-KiOurtBYyTo5r1RvWYbnfcmXJt0oxSpC0_WR0-WYjwfC-STC11gDFelSRCg_4NdOZH9cEFOKJg38x3ixssusoCmZCedVdhG5u8hU1eLBTSdgqdsIGpRw?stp=s2048x1151&edm=AOnQwmMEAAAA&_nc_gid=19kZVX5LNKqMignc-RbSlg&_nc_oc=AdmxvGGV8N0qZGtbOSftXPEyePGvyKotDvhh9tB7pA1fNgiWbSQqV7T24uMBHztRCQhjEb0ZghlL9RWWPZ7AU0sw&ccb=10-5&oh=00_AfIgMDbnZ4J-ygCC_eUU8wUYGhpcHAZpyVn1Tp02cH6jqQ&oe=68592EEB&_nc_sid=201bca"
-    chat_id, response = driving_exam_chat_controller.generate_driving_questions_for_image(image_url, city="Paris")
-    follow_up_response = driving_exam_chat_controller.ask_followup_question("But can't I park there if it is only very shortly and I make sure bycicles can still pass?", chat_id=chat_id)
+    chat_id, response = asyncio.run(driving_exam_chat_controller.generate_driving_questions_for_image(image_url, city="Paris"))
+    follow_up_response = asyncio.run(driving_exam_chat_controller.ask_followup_question("But can't I park there if it is only very shortly and I make sure bycicles can still pass?", chat_id=chat_id))
     print(follow_up_response)
\ No newline at end of file
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Dict, List, Tuple
+
+from controllers.driving_exam_chat_contoller import DrivingExamChatController
+from controllers.street_image_catalog_controller import StreetImageCatalogController
+from controllers.street_image_controller_script import download_street_image
+from shared.constants import (
+    QUESTION_POOL_TARGET_SIZE,
+    QUESTION_POOL_LOW_WATERMARK,
+    QUESTION_POOL_REFILL_CONCURRENCY,
+    QUESTION_POOL_MAX_AGE_SECONDS,
+)
+
+
+class QuestionPoolController:
+    """
+    Keeps a pool of pre-generated questions per city, keyed by image URL.
+    Each pooled question is handed out once; a background worker generates
+    new ones whenever a city drops below the low watermark.
+    """
+
+    def __init__(
+        self,
+        driving_exam_chat_controller: DrivingExamChatController,
+        cities: List[str],
+        street_image_catalog_controller: Optional[StreetImageCatalogController] = None,
+        target_size: int = QUESTION_POOL_TARGET_SIZE,
+        low_watermark: int = QUESTION_POOL_LOW_WATERMARK,
+        refill_concurrency: int = QUESTION_POOL_REFILL_CONCURRENCY,
+        max_age_seconds: float = QUESTION_POOL_MAX_AGE_SECONDS,
+        logger: Optional[logging.Logger] = None,
+        ) -> None:
+        self._driving_exam_chat_controller = driving_exam_chat_controller
+        self._street_image_catalog_controller = street_image_catalog_controller
+        self._cities = list(cities)
+        self._target_size = target_size
+        self._low_watermark = low_watermark
+        self._refill_concurrency = refill_concurrency
+        self._max_age_seconds = max_age_seconds
+        self._logger = logger or logging.getLogger(__name__)
+        # city -> image_url -> queue of (generated_at, chat_id, result)
+        self._pools: Dict[str, OrderedDict] = {city: OrderedDict() for city in self._cities}
+        self._refill_needed: Optional[asyncio.Event] = None
+        self._refill_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+
+    def take_question(self, image_url: str, city: str) -> Optional[Tuple[str, Dict]]:
+        """Pops a pre-generated (chat_id, result) for the image, or None if there is none."""
+        pool = self._pools.get(city)
+        entries = pool.get(image_url) if pool is not None else None
+        while entries:
+            generated_at, chat_id, result = entries.popleft()
+            if time.time() - generated_at <= self._max_age_seconds:
+                if not entries:
+                    del pool[image_url]
+                self.hits += 1
+                self.request_refill()
+                return chat_id, result
+        if entries is not None:
+            del pool[image_url]
+        self.misses += 1
+        return None
+
+
+    def ready_image_url(self, city: str) -> Optional[str]:
+        """Image URL that already has a pooled question, rotated so concurrent users get different images."""
+        pool = self._pools.get(city)
+        if not pool:
+            return None
+        image_url = next(iter(pool))
+        pool.move_to_end(image_url)
+        return image_url
+
+
+    def size(self, city: str) -> int:
+        return sum(len(entries) for entries in self._pools.get(city, {}).values())
+
+
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "sizes": {city: self.size(city) for city in self._cities},
+        }
+
+
+    def request_refill(self) -> None:
+        if self._refill_needed:
+            self._refill_needed.set()
+
+
+    def start_background_refill(self) -> None:
+        if self._refill_task and not self._refill_task.done():
+            return
+        self._refill_needed = asyncio.Event()
+        self._refill_needed.set()
+        self._refill_task = asyncio.get_running_loop().create_task(self._refill_loop())
+
+
+    async def stop_background_refill(self) -> None:
+        if self._refill_task:
+            self._refill_task.cancel()
+            await asyncio.gather(self._refill_task, return_exceptions=True)
+            self._refill_task = None
+
+
+    async def refill(self, city: str) -> int:
+        """Tops the pool of a city up to the target size. Returns the number of questions added."""
+        self._drop_expired(city)
+        missing = self._target_size - self.size(city)
+        if missing <= 0:
+            return 0
+        semaphore = asyncio.Semaphore(self._refill_concurrency)
+
+        async def generate_one() -> bool:
+            async with semaphore:
+                try:
+                    return await self._generate(city)
+                except Exception as e:
+                    self._logger.error(f"Pre-generating a question for {city} failed: {e}")
+                    return False
+
+        added = sum(await asyncio.gather(*(generate_one() for _ in range(missing))))
+        self._logger.info(f"Question pool for {city} refilled with {added} questions ({self.size(city)} ready)")
+        return added
+
+
+    async def _generate(self, city: str) -> bool:
+        image_url = None
+        if self._street_image_catalog_controller:
+            image_url = await self._street_image_catalog_controller.get_street_image_url(city)
+        if not image_url:
+            image_url = await download_street_image(city, limit=10)
+        if not image_url:
+            return False
+        chat_id, result = await self._driving_exam_chat_controller.generate_driving_questions_for_image(
+            image_url=image_url,
+            city=city
+        )
+        # Pooled chats must be persisted before they are handed out, whatever the persistence mode
+        await self._driving_exam_chat_controller.flush_chat_history(chat_id)
+        pool = self._pools.setdefault(city, OrderedDict())
+        pool.setdefault(image_url, deque()).append((time.time(), chat_id, result))
+        return True
+
+
+    async def _refill_loop(self) -> None:
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+            for city in self._cities:
+                self._drop_expired(city)
+                if self.size(city) < self._low_watermark:
+                    await self.refill(city)
+
+
+    def _drop_expired(self, city: str) -> None:
+        pool = self._pools.get(city, {})
+        now = time.time()
+        for image_url in list(pool):
+            entries = pool[image_url]
+            while entries and now - entries[0][0] > self._max_age_seconds:
+                entries.popleft()
+            if not entries:
+                del pool[image_url]
@@ -1,63 +1,185 @@
+import asyncio
 import logging
+import os
 import time
-from typing import Optional, List
-from upstash_vector import Index, Vector
+from itertools import islice
+from typing import Optional, List, Dict, Iterable, Iterator
 from mistralai import Mistral
 
+from clients.embedding_cache import EmbeddingCache
+from clients.vector_index import VectorIndex, UpstashVectorIndex, LocalVectorIndex, SearchFilter, SNAPSHOT_VECTORS_FILE
+from shared.rate_limiter import TokenBucketRateLimiter
+from shared.constants import (
+    MISTRAL_EMBEDDING_MODEL,
+    MISTRAL_EMBEDDINGS_RATE_PER_SECOND,
+    MISTRAL_EMBEDDINGS_BURST,
+    EMBEDDING_BATCH_SIZE,
+    UPSERT_BATCH_SIZE,
+)
+
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
 class SimilaritySearchController:
 
-    def __init__(self, index_url: str, api_key: str, mistral_client: Mistral, logger: Optional[logging.Logger]) -> None:
-        self._index = Index(url=index_url, token=api_key)
+    def __init__(
+        self,
+        index_url: str,
+        api_key: str,
+        mistral_client: Mistral,
+        logger: Optional[logging.Logger],
+        embeddings_rate_limiter: Optional[TokenBucketRateLimiter] = None,
+        index_rate_limiter: Optional[TokenBucketRateLimiter] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        index: Optional[VectorIndex] = None,
+        ) -> None:
+        # Defaults to the Upstash index at index_url
+        self._index = index if index is not None else UpstashVectorIndex(url=index_url, token=api_key, rate_limiter=index_rate_limiter)
         self._mistral = mistral_client
+        self._logger = logger or logging.getLogger(__name__)
+        self._embeddings_rate_limiter = embeddings_rate_limiter or TokenBucketRateLimiter(
+            rate_per_second=MISTRAL_EMBEDDINGS_RATE_PER_SECOND,
+            capacity=MISTRAL_EMBEDDINGS_BURST,
+            name="mistral-embeddings",
+        )
+        self._embedding_cache = embedding_cache or EmbeddingCache()
     
 
-    def add_question(self, question_id: str, question: str, image_url: str) -> None:
-        res = self._mistral.embeddings.create(
-        model="mistral-embed",
-        inputs=[question],
-        )
-        embedding = res.data[0].embedding
-        self._index.upsert(
-            vectors=[
-                Vector(
-                    id=question_id,
-                    vector=embedding,
-                    metadata={
-                        "image_url": image_url,
-                        "question": question
-                    }
-                )
-            ]
+    async def add_question(self, question_id: str, question: str, image_url: str) -> None:
+        await self.add_questions([{
+            "question_id": question_id,
+            "question": question,
+            "image_url": image_url,
+        }])
+
+
+    async def add_questions(
+        self,
+        questions: Iterable[Dict],
+        embedding_batch_size: int = EMBEDDING_BATCH_SIZE,
+        upsert_batch_size: int = UPSERT_BATCH_SIZE,
+        ) -> int:
+        """
+        Embeds questions in batches and upserts them in bulk. Each item needs question_id,
+        question and image_url, and can carry city, sign_categories and created_at for filtering.
+        """
+        pending = []
+        added = 0
+        for batch in _batched(questions, embedding_batch_size):
+            embeddings = await self.embed_texts([item["question"] for item in batch])
+            pending.extend(zip(batch, embeddings))
+            while len(pending) >= upsert_batch_size:
+                added += await self.upsert_questions(pending[:upsert_batch_size])
+                pending = pending[upsert_batch_size:]
+        if pending:
+            added += await self.upsert_questions(pending)
+        return added
+
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        await self._embeddings_rate_limiter.acquire()
+        res = await self._mistral.embeddings.create_async(
+            model=MISTRAL_EMBEDDING_MODEL,
+            inputs=texts,
         )
-        time.sleep(2)
+        return [item.embedding for item in res.data]
+
+
+    async def upsert_questions(self, embedded_questions: List) -> int:
+        """Upserts (question, embedding) pairs with a single index request."""
+        await self._index.upsert([
+            (item["question_id"], embedding, self._question_metadata(item))
+            for item, embedding in embedded_questions
+        ])
+        self._logger.info(f"Upserted {len(embedded_questions)} questions into the index")
+        return len(embedded_questions)
     
 
-    def search(self, query: str, top_k: int = 5) -> List[str]:
-        res = self._mistral.embeddings.create(
-            model="mistral-embed",
-            inputs=[query],
-        )
-        embedding = res.data[0].embedding
-        results = self._index.query(
-            vector=embedding,
-            top_k=top_k,
-            include_metadata=True
-        )
-        time.sleep(2)
+    async def embed_query(self, query: str) -> List[float]:
+        """Embedding of a search query, served from the embedding cache when the query was seen before."""
+        query = EmbeddingCache.normalize(query)
+        embedding = await self._embedding_cache.get(query)
+        if embedding is None:
+            embedding = (await self.embed_texts([query]))[0]
+            await self._embedding_cache.set(query, embedding)
+        return embedding
+
+
+    async def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        city: Optional[str] = None,
+        sign_categories: Optional[List[str]] = None,
+        created_after: Optional[float] = None,
+        ) -> List[str]:
+        """Image URLs of the questions closest to the query, optionally only those matching the metadata filter."""
+        embedding = await self.embed_query(query)
+        search_filter = SearchFilter(city=city, sign_categories=sign_categories, created_after=created_after)
+        results = await self._index.query(embedding, top_k=top_k, search_filter=search_filter or None)
         return [
-            result.metadata["image_url"] for result in results
+            result["metadata"]["image_url"] for result in results
         ]
     
 
-    def delete_question(self, question_id: str) -> None:
-        self._index.delete(ids=[question_id])
-        time.sleep(2)
+    @staticmethod
+    def _question_metadata(item: Dict) -> Dict:
+        metadata = {
+            "image_url": item["image_url"],
+            "question": item["question"],
+            "sign_categories": list(item.get("sign_categories") or []),
+            "created_at": int(item.get("created_at") or time.time()),
+        }
+        if item.get("city"):
+            metadata["city"] = item["city"]
+        return metadata
+
+
+    async def delete_question(self, question_id: str) -> None:
+        await self._index.delete([question_id])
+
+
+    async def export_snapshot(self, path: str) -> int:
+        """Writes all vectors and metadata of the index to a snapshot directory. Returns the number of vectors."""
+        snapshot = LocalVectorIndex(logger=self._logger)
+        async for batch in self._index.scan():
+            snapshot.add(batch)
+            self._logger.info(f"Exported {len(snapshot)} vectors")
+        snapshot.save(path)
+        return len(snapshot)
+
+
+    async def import_snapshot(self, path: str, upsert_batch_size: int = UPSERT_BATCH_SIZE) -> int:
+        """Bulk-loads a snapshot written by export_snapshot into the index. Returns the number of vectors."""
+        if not os.path.exists(os.path.join(path, SNAPSHOT_VECTORS_FILE)):
+            raise FileNotFoundError(f"No index snapshot in {path}")
+        snapshot = LocalVectorIndex(snapshot_path=path, logger=self._logger)
+        imported = 0
+        async for batch in snapshot.scan(upsert_batch_size):
+            await self._index.upsert(batch)
+            imported += len(batch)
+            self._logger.info(f"Imported {imported}/{len(snapshot)} vectors")
+        return imported
+
+
+    def rate_limiter_stats(self) -> List[Dict]:
+        return [
+            self._embeddings_rate_limiter.stats(),
+            self._index.stats(),
+        ]
+
+
+    def embedding_cache_stats(self) -> Dict:
+        return self._embedding_cache.stats()
 
 
 if __name__ == "__main__":
 
     from dotenv import load_dotenv, find_dotenv
-    import os
     load_dotenv(find_dotenv())
 
     index_url = os.getenv("VECTOR_DB_ENDPOINT")
@@ -71,6 +193,6 @@ if __name__ == "__main__":
         mistral_client=mistral_client,
         logger=logging.getLogger(__name__)
     )
-    print(sim_search_controller.search("What is the speed limit in Paris?"), 1)
+    print(asyncio.run(sim_search_controller.search("What is the speed limit in Paris?", 1)))
 
 
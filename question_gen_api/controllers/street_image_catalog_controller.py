@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Optional, Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from clients.mapillary_client import MapillaryClient
+from clients.street_image_catalog_store import StreetImageCatalogStore
+from controllers import street_image_controller_script as street_images
+from shared.constants import (
+    CATALOG_IMAGES_PER_CITY,
+    CATALOG_REFRESH_SECONDS,
+    CATALOG_CHECK_INTERVAL_SECONDS,
+    CATALOG_IMAGE_URL_EXPIRY_MARGIN_SECONDS,
+    CATALOG_IMAGE_URL_LIFETIME_SECONDS,
+    MAPILLARY_GRAPH_URL,
+    IMAGE_SIZE,
+)
+
+
+class _AliasSampler:
+    """Walker/Vose alias table: O(n) to build, O(1) weighted random pick."""
+
+    def __init__(self, items: List, weights: List[float]) -> None:
+        n = len(items)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights] if total > 0 else [1.0] * n
+        self._items = items
+        self._probability = [0.0] * n
+        self._alias = [0] * n
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self._probability[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:
+            self._probability[i] = 1.0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def pick(self):
+        i = random.randrange(len(self._items))
+        return self._items[i] if random.random() < self._probability[i] else self._items[self._alias[i]]
+
+
+class StreetImageCatalogController:
+    """
+    Serves street images from a locally stored, pre-scored catalog per city.
+    The catalog is scraped with the regular Mapillary pipeline and refreshed in
+    the background, so picking an image never waits on the search queries.
+    Thumbnail URLs are signed and expire: the stored URL of a picked image is
+    served until it is about to expire, then resolved again from its image id.
+    """
+
+    def __init__(
+        self,
+        store: StreetImageCatalogStore,
+        cities: List[str],
+        images_per_city: int = CATALOG_IMAGES_PER_CITY,
+        refresh_seconds: float = CATALOG_REFRESH_SECONDS,
+        logger: Optional[logging.Logger] = None,
+        http_client: Optional[MapillaryClient] = None,
+        ) -> None:
+        self._store = store
+        self._cities = list(cities)
+        self._images_per_city = images_per_city
+        self._refresh_seconds = refresh_seconds
+        self._logger = logger or logging.getLogger(__name__)
+        self._http_client = http_client or street_images.mapillary_client
+        self._samplers: Dict[str, _AliasSampler] = {}
+        # Per city: image id -> (image URL, expiry in seconds since epoch)
+        self._image_urls: Dict[str, Dict[str, Tuple[str, float]]] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        for city in self._cities:
+            self._load_sampler(city)
+
+
+    async def get_street_image_url(self, city: str) -> Optional[str]:
+        sampler = self._samplers.get(city)
+        if not sampler:
+            return None
+        image_id = sampler.pick()
+        image_url, expires_at = self._image_urls[city][image_id]
+        if time.time() < expires_at - CATALOG_IMAGE_URL_EXPIRY_MARGIN_SECONDS:
+            return image_url
+        resolved_url = await self._resolve_image_url(image_id)
+        if resolved_url:
+            self._image_urls[city][image_id] = (resolved_url, _url_expiry(resolved_url, time.time()))
+            await asyncio.to_thread(self._store.update_image_url, city, image_id, resolved_url)
+            return resolved_url
+        # Still usable for a little while if Mapillary could not resolve it
+        return image_url if time.time() < expires_at else None
+
+
+    async def build_city(self, city: str) -> int:
+        """Scrapes, filters and scores the candidates of a city and replaces its catalog."""
+        client = self._http_client
+        coords = await street_images.get_city_coordinates(city, client)
+        if not coords:
+            raise RuntimeError(f"Could not geocode {city}")
+        images = await street_images.get_educational_images(coords, self._images_per_city, client)
+        if not images:
+            raise RuntimeError(f"No Mapillary candidates found for {city}")
+        images = street_images.filter_quality_cameras(images)
+        candidates = await street_images.get_images_with_detections(images, coords, client)
+
+        scores = street_images.scoring_engine.scores(candidates)
+        has_traffic_sign = candidates.detected("educational")
+        has_infrastructure = candidates.detected("road_infrastructure")
+        has_vehicle = candidates.detected("vehicle_content")
+        entries = [
+            {
+                "image_id": img["id"],
+                "image_url": street_images.get_image_url(img),
+                "score": float(scores[i]),
+                "has_traffic_sign": bool(has_traffic_sign[i]),
+                "has_infrastructure": bool(has_infrastructure[i]),
+                "has_vehicle": bool(has_vehicle[i]),
+                "captured_at": img.get("captured_at"),
+            }
+            for i, img in enumerate(candidates.images)
+            if street_images.get_image_url(img)
+        ]
+        await asyncio.to_thread(self._store.replace_city, city, entries)
+        self._set_sampler(city, entries, time.time())
+        self._logger.info(f"Built street image catalog for {city} with {len(entries)} images")
+        return len(entries)
+
+
+    async def refresh_stale_cities(self) -> None:
+        for city in self._cities:
+            built_at = await asyncio.to_thread(self._store.built_at, city)
+            if built_at is not None and time.time() - built_at < self._refresh_seconds:
+                continue
+            try:
+                await self.build_city(city)
+            except Exception as e:
+                self._logger.error(f"Refreshing street image catalog for {city} failed: {e}")
+
+
+    def start_background_refresh(self, interval_seconds: float = CATALOG_CHECK_INTERVAL_SECONDS) -> None:
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_loop(interval_seconds))
+
+
+    async def stop_background_refresh(self) -> None:
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+
+    async def _refresh_loop(self, interval_seconds: float) -> None:
+        while True:
+            await self.refresh_stale_cities()
+            await asyncio.sleep(interval_seconds)
+
+
+    async def _resolve_image_url(self, image_id: str) -> Optional[str]:
+        """Current signed thumbnail URL of an image, None when Mapillary cannot resolve it."""
+        try:
+            response = await self._http_client.get(
+                f"{MAPILLARY_GRAPH_URL}/{image_id}",
+                params={"access_token": street_images.MAPILLARY_TOKEN, "fields": IMAGE_SIZE},
+            )
+        except Exception as e:
+            self._logger.warning(f"Resolving catalog image {image_id} failed: {e}")
+            return None
+        if response.status_code != 200:
+            self._logger.warning(f"Resolving catalog image {image_id} failed with HTTP {response.status_code}")
+            return None
+        return response.json().get(IMAGE_SIZE)
+
+
+    def _load_sampler(self, city: str) -> None:
+        self._set_sampler(city, self._store.load_city(city), self._store.built_at(city))
+
+
+    def _set_sampler(self, city: str, rows: List[Dict], built_at: Optional[float]) -> None:
+        if not rows:
+            self._samplers.pop(city, None)
+            self._image_urls.pop(city, None)
+            return
+        self._image_urls[city] = {
+            str(row["image_id"]): (row["image_url"], _url_expiry(row["image_url"], built_at or 0.0))
+            for row in rows
+        }
+        self._samplers[city] = _AliasSampler(
+            [str(row["image_id"]) for row in rows],
+            [row["score"] for row in rows],
+        )
+
+
+def _url_expiry(image_url: str, issued_at: float) -> float:
+    """Expiry of a signed fbcdn URL from its hex `oe` parameter, else an assumed lifetime from `issued_at`."""
+    oe = parse_qs(urlsplit(image_url).query).get("oe")
+    try:
+        return float(int(oe[0], 16))
+    except (TypeError, ValueError):
+        return issued_at + CATALOG_IMAGE_URL_LIFETIME_SECONDS
@@ -1,155 +1,149 @@
 
-import requests
-import random
+import asyncio
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from typing import AsyncIterator, Optional, Dict, List
+
+import numpy as np
+
+from clients.geocoding_client import GeocodingClient
+from clients.mapillary_client import MapillaryClient
+from shared.image_scoring import ImageCandidates, ImageScoringEngine, STREET_IMAGE_SCORING_PROFILE
 
 from shared.constants import (
     DEFAULT_STREET_IMAGE_LIMIT,
     STREET_IMAGE_QUALITY_THRESHOLD,
-    PREFERRED_CAMERA_MAKES,
     SEARCH_RADIUS_KM,
     SEARCH_YEARS_BACK,
     FETCH_MULTIPLIER,
     TRAFFIC_SIGN_RADIUS_KM,
+    TRAFFIC_SIGN_MAX_PAGES,
     TRAFFIC_SIGN_TYPES,
-    MAX_TOP_CANDIDATES,
-    EDUCATION_WEIGHT,
-    QUALITY_WEIGHT,
-    RECENCY_WEIGHT,
-    RECENT_THRESHOLD_DAYS,
-    MEDIUM_RECENT_DAYS,
-    OLD_THRESHOLD_DAYS,
-    RECENT_SCORE,
-    MEDIUM_RECENT_SCORE,
-    OLD_SCORE,
-    VERY_OLD_SCORE,
+    MAPILLARY_IMAGES_URL,
+    MAPILLARY_MAP_FEATURES_URL,
+    MAPILLARY_MAX_PAGE_SIZE,
     IMAGE_SIZE
 )
 
 
 class StreetImageController:
 
-    def __init__(self, api_token: str):
+    def __init__(self, api_token: str, geocoding_client: Optional[GeocodingClient] = None, http_client: Optional[MapillaryClient] = None):
         self._api_token = api_token
+        self._geocoding_client = geocoding_client or GeocodingClient()
+        self._http_client = http_client or MapillaryClient()
+        self._scoring = ImageScoringEngine(STREET_IMAGE_SCORING_PROFILE)
+
+    async def get_street_image_url(self, city="Paris", limit: int=DEFAULT_STREET_IMAGE_LIMIT, quality_threshold: str=STREET_IMAGE_QUALITY_THRESHOLD) -> Optional[str]:
+        image = await self.get_street_image(city, limit, quality_threshold)
+        return image["image_url"] if image else None
+
 
-    def get_street_image_url(self, city="Paris", limit: int=DEFAULT_STREET_IMAGE_LIMIT, quality_threshold: str=STREET_IMAGE_QUALITY_THRESHOLD) -> Optional[str]:
+    async def get_street_image(self, city="Paris", limit: int=DEFAULT_STREET_IMAGE_LIMIT, quality_threshold: str=STREET_IMAGE_QUALITY_THRESHOLD) -> Optional[Dict]:
+        """Like get_street_image_url, but returns {image_url, city, sign_categories, captured_at}."""
+        client = self._http_client
 
         # 1. Get city coordinates
-        coords = self._get_city_coordinates(city)
+        coords = await self._get_city_coordinates(client, city)
         if not coords:
             return None
 
         # 2. Fetch available images with enhanced filtering
-        images = self._get_educational_images(coords, limit, quality_threshold)
-        if not images:
+        candidates = await self._get_educational_images(client, coords, limit, quality_threshold)
+        if not candidates:
             return None
 
         # 3. Select the best image and return URL
-        selected = self._select_best_educational_image(images)
+        selected = self._scoring.select(candidates)
         image_url = self._get_image_url(selected)
-        
-        return image_url
+        if not image_url:
+            return None
 
+        return {
+            "image_url": image_url,
+            "city": city,
+            "sign_categories": selected.get("sign_categories", []),
+            "captured_at": selected.get("captured_at"),
+        }
 
-    def _get_city_coordinates(self, city: str) -> Optional[Dict[str, float]]:
-        """Gets city coordinates via Nominatim geocoding service."""
-        try:
-            response = requests.get(
-                "https://nominatim.openstreetmap.org/search",
-                params={"q": city, "format": "json", "limit": 1},
-                headers={"User-Agent": "roadbuddy/1.0"},
-                timeout=5
-            )
-            
-            data = response.json()
-            if not data:
-                return None
-            
-            lat = float(data[0]["lat"])
-            lon = float(data[0]["lon"])
-            
-            return {"lat": lat, "lon": lon}
-            
-        except:
-            return None
+
+    async def _get_city_coordinates(self, client: MapillaryClient, city: str) -> Optional[Dict[str, float]]:
+        """Gets city coordinates, served from the geocode cache whenever possible."""
+        return await self._geocoding_client.get_coordinates(city, client)
 
 
-    def _get_educational_images(self, coords: Dict[str, float], limit: int, quality_threshold: float) -> Optional[List]:
+    async def _get_educational_images(self, client: MapillaryClient, coords: Dict[str, float], limit: int, quality_threshold: float) -> Optional[ImageCandidates]:
         try:
-            # Create search area around the point (configurable radius)
-            margin = SEARCH_RADIUS_KM / 111.0  # Convert km to degrees (approximate)
-            bbox = f"{coords['lon']-margin},{coords['lat']-margin},{coords['lon']+margin},{coords['lat']+margin}"
-            
-            # Calculate date filter for recent images (configurable years back)
-            years_ago = datetime.now() - timedelta(days=SEARCH_YEARS_BACK * 365)
-            start_date = years_ago.strftime("%Y-%m-%dT%H:%M:%SZ")
-            
-            # Request more images for better selection (configurable multiplier)
-            fetch_limit = limit * FETCH_MULTIPLIER
-            
-            response = requests.get(
-                "https://graph.mapillary.com/images",
-                params={
-                    "access_token": self._api_token,
-                    "bbox": bbox,
-                    "limit": fetch_limit,
-                    "start_captured_at": start_date,
-                    "fields": "id,thumb_2048_url,compass_angle,make,model,captured_at"
-                },
-                timeout=10
-            )
-            
-            if response.status_code != 200:
+            # Look for images with traffic signs first, they decide which images are worth harvesting
+            sign_categories = await self._get_traffic_sign_categories(client, coords)
+
+            seen = []
+            def with_traffic_signs(page: List[Dict]) -> List[Dict]:
+                seen.extend(page)
+                if not sign_categories:
+                    return page  # Detection failed or found no signs, any image will do
+                return [img for img in page if str(img['id']) in sign_categories]
+
+            # Images with traffic signs, following Mapillary's paging cursor until `limit` were found,
+            # or every image seen if none has one
+            images = [img async for img in self._harvest_images(client, coords, limit, with_traffic_signs)] or seen[:limit]
+            if not images:
                 return None
-            
-            all_images = response.json().get("data", [])
-            
-            # Filter for quality cameras (configurable camera list)
-            quality_images = self._filter_quality_cameras(all_images)
-            
-            # Look for images with traffic signs and infrastructure
-            educational_images = self._get_images_with_detections(quality_images, coords)
-            
-            if not educational_images:
-                return quality_images[:limit] if quality_images else all_images[:limit]
-            
-            return educational_images[:limit]
+
+            for img in images:
+                if sign_categories and str(img['id']) in sign_categories:
+                    img['sign_categories'] = sign_categories[str(img['id'])]
+
+            candidates = self._scoring.candidates(images)
+            detected_ids = None if sign_categories is None else {"educational": set(sign_categories)}
+            self._scoring.apply_detections(candidates, detected_ids)
+
+            # Quality cameras first (configurable camera list)
+            return candidates.take(np.argsort(-candidates.column("quality"), kind="stable"))
         
         except:
             return None
 
 
-    def _filter_quality_cameras(self, images):
-        """Filter images from higher quality cameras for better educational content."""
-        quality_images = []
-        other_images = []
+    def _harvest_images(self, client: MapillaryClient, coords: Dict[str, float], limit: int, accept) -> AsyncIterator[Dict]:
+        # Create search area around the point (configurable radius)
+        margin = SEARCH_RADIUS_KM / 111.0  # Convert km to degrees (approximate)
+        bbox = f"{coords['lon']-margin},{coords['lat']-margin},{coords['lon']+margin},{coords['lat']+margin}"
         
-        for img in images:
-            make = img.get('make', '').strip()
-            if any(preferred in make for preferred in PREFERRED_CAMERA_MAKES):
-                img['quality_score'] = 1.0
-                quality_images.append(img)
-            else:
-                img['quality_score'] = 0.5
-                other_images.append(img)
+        # Calculate date filter for recent images (configurable years back)
+        years_ago = datetime.now() - timedelta(days=SEARCH_YEARS_BACK * 365)
+        start_date = years_ago.strftime("%Y-%m-%dT%H:%M:%SZ")
         
-        # Return quality images first, then others
-        return quality_images + other_images
-
-
-    def _get_images_with_detections(self, images, coords):
-        """Query for images that likely contain traffic signs and educational content."""
+        # Pages sized for the expected share of images with traffic signs (configurable multiplier)
+        page_size = min(limit * FETCH_MULTIPLIER, MAPILLARY_MAX_PAGE_SIZE)
+        
+        return client.harvest(
+            MAPILLARY_IMAGES_URL,
+            params={
+                "access_token": self._api_token,
+                "bbox": bbox,
+                "limit": page_size,
+                "start_captured_at": start_date,
+                "fields": "id,thumb_2048_url,compass_angle,make,model,captured_at"
+            },
+            accept=accept,
+            needed=limit,
+        )
+
+
+    async def _get_traffic_sign_categories(self, client: MapillaryClient, coords) -> Optional[Dict[str, List[str]]]:
+        """Sign categories (regulatory, warning, ...) per image id with traffic signs, None when detection fails."""
         try:
             # Create a smaller search area for traffic sign detection (configurable)
             margin = TRAFFIC_SIGN_RADIUS_KM / 111.0  # Convert km to degrees
             bbox = f"{coords['lon']-margin},{coords['lat']-margin},{coords['lon']+margin},{coords['lat']+margin}"
             
-            # Query for map features (configurable traffic sign types)
+            # Query for map features (configurable traffic sign types), only the first pages of them
             traffic_signs_query = ",".join(TRAFFIC_SIGN_TYPES)
             
-            response = requests.get(
-                "https://graph.mapillary.com/map_features",
+            image_sign_categories = {}
+            pages = 0
+            async for features in client.pages(
+                MAPILLARY_MAP_FEATURES_URL,
                 params={
                     "access_token": self._api_token,
                     "bbox": bbox,
@@ -157,86 +151,22 @@ class StreetImageController:
                     "object_values": traffic_signs_query,
                     "fields": "id,object_value,images"
                 },
-                timeout=8
-            )
-            
-            if response.status_code == 200:
-                features = response.json().get("data", [])
-                
-                # Collect image IDs that have traffic signs
-                educational_image_ids = set()
+                max_pages=TRAFFIC_SIGN_MAX_PAGES,
+            ):
+                pages += 1
                 for feature in features:
-                    image_ids = feature.get('images', [])
-                    educational_image_ids.update(image_ids)
-                
-                # Filter our images to those with traffic signs
-                educational_images = []
-                for img in images:
-                    if img['id'] in educational_image_ids:
-                        img['educational_score'] = 1.0
-                        educational_images.append(img)
-                    else:
-                        img['educational_score'] = 0.3
-                
-                return educational_images
+                    category = feature.get('object_value', '').split('--')[0]
+                    for image_id in feature.get('images', []):
+                        image_sign_categories.setdefault(str(image_id), set()).add(category)
+            
+            if pages:
+                return {image_id: sorted(categories) for image_id, categories in image_sign_categories.items()}
         
         except:
             pass
         
-        # If traffic sign detection fails, return all images with basic scoring
-        for img in images:
-            img['educational_score'] = 0.5
-        return images
-
-
-    def _select_best_educational_image(self, images):
-        """Select the best image based on educational value and quality (configurable weights)."""
-        if not images:
-            return None
-        
-        # Sort by educational score, then quality score (configurable weights)
-        
-        sorted_images = sorted(images, key=self._score_image, reverse=True)
-        
-        # Add some randomness among top candidates (configurable number)
-        top_candidates = sorted_images[:min(MAX_TOP_CANDIDATES, len(sorted_images))]
-        selected = random.choice(top_candidates)
-        
-        return selected
-    
-    def _score_image(self, img):
-        educational_score = img.get('educational_score', 0)
-        quality_score = img.get('quality_score', 0.5)
-        recency_score = self._calculate_recency_score(img.get('captured_at', 0))
-        
-        # Weighted combined score (configurable weights)
-        return (educational_score * EDUCATION_WEIGHT) + \
-            (quality_score * QUALITY_WEIGHT) + \
-            (recency_score * RECENCY_WEIGHT)
-
-
-    def _calculate_recency_score(self, captured_at):
-        """Calculate a score based on how recent the image is (configurable thresholds)."""
-        if not captured_at:
-            return 0
-        
-        try:
-            # captured_at is in milliseconds since epoch
-            capture_date = datetime.fromtimestamp(captured_at / 1000)
-            now = datetime.now()
-            days_ago = (now - capture_date).days
-            
-            # More recent images get higher scores (configurable thresholds)
-            if days_ago < RECENT_THRESHOLD_DAYS:
-                return RECENT_SCORE
-            elif days_ago < MEDIUM_RECENT_DAYS:
-                return MEDIUM_RECENT_SCORE
-            elif days_ago < OLD_THRESHOLD_DAYS:
-                return OLD_SCORE
-            else:
-                return VERY_OLD_SCORE
-        except:
-            return 0.5
+        # If traffic sign detection fails, every image gets the fallback score
+        return None
 
 
     def _get_image_url(self, image_data):
@@ -259,7 +189,7 @@ if __name__ == "__main__":
 
 
     controller = StreetImageController(api_token=api_token)
-    result = controller.get_street_image_url("Paris", limit=10)
+    result = asyncio.run(controller.get_street_image_url("Paris", limit=10))
     
     if result:
         print(result)
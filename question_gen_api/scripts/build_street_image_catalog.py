@@ -0,0 +1,41 @@
+from dotenv import load_dotenv, find_dotenv
+import argparse
+import asyncio
+import logging
+import os
+load_dotenv(find_dotenv(), override=True)
+
+from clients.street_image_catalog_store import StreetImageCatalogStore
+from controllers.street_image_catalog_controller import StreetImageCatalogController
+from shared.constants import STREET_IMAGE_CATALOG_PATH, SUPPORTED_CITY_COORDINATES, CATALOG_IMAGES_PER_CITY
+
+
+async def build_catalog(catalog_path: str, cities, images_per_city: int, logger: logging.Logger) -> None:
+    controller = StreetImageCatalogController(
+        store=StreetImageCatalogStore(catalog_path),
+        cities=cities,
+        images_per_city=images_per_city,
+        logger=logger,
+    )
+    for city in cities:
+        count = await controller.build_city(city)
+        logger.info(f"{city}: {count} images catalogued")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Scrape each city once into the local street image catalog.")
+    parser.add_argument("--catalog", default=os.getenv("STREET_IMAGE_CATALOG_PATH", STREET_IMAGE_CATALOG_PATH))
+    parser.add_argument("--cities", nargs="+", default=list(SUPPORTED_CITY_COORDINATES))
+    parser.add_argument("--images-per-city", type=int, default=CATALOG_IMAGES_PER_CITY)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("build_street_image_catalog")
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler()
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    asyncio.run(build_catalog(args.catalog, args.cities, args.images_per_city, logger))
+    logger.info("Catalog build completed.")
@@ -1,46 +1,373 @@
 from dotenv import load_dotenv, find_dotenv
 from mistralai import Mistral
-from typing import Optional
+from typing import Optional, List, Dict, Set
+import argparse
+import asyncio
+import json
 import logging
 import os
+import random
+import time
 load_dotenv(find_dotenv(), override=True)
 
 from clients.s3_client import AWSS3Client
 from clients.role_assumer_client import AWSRoleAssumer
+from clients.chat_store import S3ChatStore
+from clients.question_cache import image_key
 
 from controllers.street_image_controller import StreetImageController
 from controllers.driving_exam_chat_contoller import DrivingExamChatController
 from controllers.similarity_search_controller import SimilaritySearchController
+from shared.constants import EMBEDDING_BATCH_SIZE, UPSERT_BATCH_SIZE
 
+DEFAULT_CHECKPOINT_PATH = "index_checkpoint.jsonl"
+DISCOVERY_WORKERS = 4         # Concurrent Mapillary/Nominatim lookups
+GENERATION_WORKERS = 4        # Concurrent Pixtral completions
+STAGE_QUEUE_SIZE = 16         # Items buffered between two stages (backpressure)
+BATCH_LINGER_SECONDS = 2.0    # Max wait for a batch to fill before flushing it
+REPORT_INTERVAL_SECONDS = 30.0
+FAILURE_BACKOFF_SECONDS = 1.0       # Wait before claiming new work after a failure, doubled per consecutive failure
+FAILURE_BACKOFF_MAX_SECONDS = 60.0
+MAX_CONSECUTIVE_FAILURES = 50       # Abort the run once this many items or batches failed in a row
+MAX_CONSECUTIVE_DUPLICATES = 100    # Stop the run once discovery keeps returning images already indexed for the city
 
-def fill_index_with_questions(
+
+class StageStats:
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.busy_seconds = 0.0
+        self._started_at = time.monotonic()
+
+    def record(self, started_at: float, items: int = 1, failed: bool = False, skipped: bool = False) -> None:
+        self.busy_seconds += time.monotonic() - started_at
+        if skipped:
+            self.skipped += items
+        elif failed:
+            self.failed += items
+        else:
+            self.processed += items
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self._started_at, 1e-9)
+        per_busy_second = self.processed / self.busy_seconds if self.busy_seconds else 0.0
+        return (
+            f"{self.name}: {self.processed} ok, {self.failed} failed, {self.skipped} skipped, "
+            f"{self.processed / elapsed:.2f} items/s wall, {per_busy_second:.2f} items/s per busy worker"
+        )
+
+
+class IndexCheckpoint:
+    """
+    Append-only JSONL log of questions that made it into the index. Images are
+    identified by image_key, signed URLs of the same image differ between runs.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self.question_ids: Set[str] = set()
+        self.image_keys: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    self.question_ids.add(entry["question_id"])
+                    # Checkpoints written before image keys only hold the URL
+                    self.image_keys.add(entry.get("image_key") or image_key(entry["image_url"]))
+
+    def __len__(self) -> int:
+        return len(self.question_ids)
+
+    def append(self, questions: List[Dict]) -> None:
+        with open(self._path, "a", encoding="utf-8") as f:
+            for item in questions:
+                key = image_key(item["image_url"])
+                f.write(json.dumps({"question_id": item["question_id"], "image_key": key, "image_url": item["image_url"]}) + "\n")
+                self.question_ids.add(item["question_id"])
+                self.image_keys.add(key)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class QuestionIndexBuilder:
+    """
+    Pipelined index filler: image discovery -> question generation -> embedding -> upsert.
+    Stages are connected by bounded queues so a slow stage throttles the ones before it,
+    and every upserted batch is checkpointed so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(
+        self,
+        street_image_controller: StreetImageController,
+        driving_exam_chat_controller: DrivingExamChatController,
+        similarity_search_controller: SimilaritySearchController,
+        city: str = "Paris",
+        checkpoint_path: str = DEFAULT_CHECKPOINT_PATH,
+        discovery_workers: int = DISCOVERY_WORKERS,
+        generation_workers: int = GENERATION_WORKERS,
+        queue_size: int = STAGE_QUEUE_SIZE,
+        embedding_batch_size: int = EMBEDDING_BATCH_SIZE,
+        upsert_batch_size: int = UPSERT_BATCH_SIZE,
+        logger: Optional[logging.Logger] = None,
+        ) -> None:
+        self._street_image_controller = street_image_controller
+        self._driving_exam_chat_controller = driving_exam_chat_controller
+        self._similarity_search_controller = similarity_search_controller
+        self._city = city
+        self._checkpoint = IndexCheckpoint(checkpoint_path)
+        self._discovery_workers = discovery_workers
+        self._generation_workers = generation_workers
+        self._queue_size = queue_size
+        self._embedding_batch_size = embedding_batch_size
+        self._upsert_batch_size = upsert_batch_size
+        self._logger = logger or logging.getLogger(__name__)
+
+        self._stats = {name: StageStats(name) for name in ("discovery", "generation", "embedding", "upsert")}
+        self._target = 0
+        self._in_flight = 0
+        self._claimed_keys: Set[str] = set()
+        self._slots = asyncio.Condition()
+        self._done = asyncio.Event()
+        self._consecutive_failures = 0
+        self._consecutive_duplicates = 0
+        self._exhausted = False
+        self._aborted = False
+
+
+    async def run(self, count: int) -> int:
+        """Fills the index until `count` questions (including checkpointed ones) are stored."""
+        self._target = count
+        if len(self._checkpoint) >= count:
+            self._logger.info(f"Checkpoint already holds {len(self._checkpoint)}/{count} questions, nothing to do.")
+            return len(self._checkpoint)
+        self._logger.info(f"Resuming from checkpoint with {len(self._checkpoint)}/{count} questions.")
+
+        image_queue = asyncio.Queue(maxsize=self._queue_size)
+        question_queue = asyncio.Queue(maxsize=self._queue_size)
+        embedded_queue = asyncio.Queue(maxsize=self._queue_size)
+
+        workers = [
+            *(asyncio.create_task(self._discover(image_queue)) for _ in range(self._discovery_workers)),
+            *(asyncio.create_task(self._generate(image_queue, question_queue)) for _ in range(self._generation_workers)),
+            asyncio.create_task(self._embed(question_queue, embedded_queue)),
+            asyncio.create_task(self._upsert(embedded_queue)),
+            asyncio.create_task(self._report()),
+        ]
+        try:
+            await self._done.wait()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._log_stats()
+        if self._exhausted and len(self._checkpoint) < count:
+            self._logger.warning(
+                f"Stopped with {len(self._checkpoint)}/{count} questions, {self._city} keeps returning indexed images."
+            )
+        if self._aborted:
+            raise RuntimeError(
+                f"Aborted after {self._consecutive_failures} consecutive failures "
+                f"with {len(self._checkpoint)}/{count} questions in the index"
+            )
+        return len(self._checkpoint)
+
+
+    async def _claim_slot(self) -> bool:
+        # Back off while upstream calls keep failing instead of retrying at once
+        delay = self._failure_backoff()
+        if delay:
+            await asyncio.sleep(delay)
+        # Only start as many items as are still missing, failed items give their slot back
+        async with self._slots:
+            await self._slots.wait_for(
+                lambda: self._done.is_set() or self._exhausted or len(self._checkpoint) + self._in_flight < self._target
+            )
+            if self._done.is_set() or self._exhausted:
+                return False
+            self._in_flight += 1
+            return True
+
+
+    async def _release_slots(self, count: int = 1, failed: bool = False, duplicate: bool = False) -> None:
+        async with self._slots:
+            self._in_flight -= count
+            if duplicate:
+                # Not a failure, but the city has no new images left once they keep repeating
+                self._consecutive_duplicates += 1
+                if self._consecutive_duplicates >= MAX_CONSECUTIVE_DUPLICATES:
+                    # Stop discovering, the images still in flight finish first
+                    self._exhausted = True
+            elif failed:
+                self._consecutive_failures += 1
+                if self._consecutive_failures >= MAX_CONSECUTIVE_FAILURES and not self._aborted:
+                    self._logger.error(f"{self._consecutive_failures} consecutive failures, aborting the run.")
+                    self._aborted = True
+                    self._done.set()
+            else:
+                self._consecutive_failures = 0
+            if len(self._checkpoint) >= self._target or (self._exhausted and not self._in_flight):
+                self._done.set()
+            self._slots.notify_all()
+
+
+    def _failure_backoff(self) -> float:
+        if not self._consecutive_failures:
+            return 0.0
+        delay = min(FAILURE_BACKOFF_MAX_SECONDS, FAILURE_BACKOFF_SECONDS * 2 ** (self._consecutive_failures - 1))
+        return random.uniform(delay / 2, delay)
+
+
+    async def _discover(self, image_queue: asyncio.Queue) -> None:
+        stats = self._stats["discovery"]
+        while await self._claim_slot():
+            started_at = time.monotonic()
+            try:
+                image = await self._street_image_controller.get_street_image(city=self._city)
+            except Exception as e:
+                self._logger.error(f"Image discovery failed: {e}")
+                image = None
+            image_url = image["image_url"] if image else None
+            if not image_url:
+                stats.record(started_at, failed=True)
+                await self._release_slots(failed=True)
+                continue
+            key = image_key(image_url)
+            if key in self._checkpoint.image_keys or key in self._claimed_keys:
+                stats.record(started_at, skipped=True)
+                await self._release_slots(duplicate=True)
+                continue
+            self._claimed_keys.add(key)
+            self._consecutive_duplicates = 0
+            stats.record(started_at)
+            await image_queue.put(image)
+
+
+    async def _generate(self, image_queue: asyncio.Queue, question_queue: asyncio.Queue) -> None:
+        stats = self._stats["generation"]
+        while True:
+            image = await image_queue.get()
+            image_url = image["image_url"]
+            started_at = time.monotonic()
+            try:
+                chat_id, results = await self._driving_exam_chat_controller.generate_driving_questions_for_image(
+                    image_url=image_url,
+                    city=self._city
+                )
+            except Exception as e:
+                self._logger.error(f"Question generation failed for {image_url}: {e}")
+                results = None
+            if not results:
+                stats.record(started_at, failed=True)
+                self._claimed_keys.discard(image_key(image_url))
+                await self._release_slots(failed=True)
+                continue
+            stats.record(started_at)
+            await question_queue.put({
+                "question_id": chat_id,
+                "question": results["question"],
+                "image_url": image_url,
+                "city": self._city,
+                "sign_categories": image["sign_categories"],
+                "created_at": int(time.time()),
+            })
+
+
+    async def _embed(self, question_queue: asyncio.Queue, embedded_queue: asyncio.Queue) -> None:
+        stats = self._stats["embedding"]
+        while True:
+            batch = await self._collect_batch(question_queue, self._embedding_batch_size)
+            started_at = time.monotonic()
+            try:
+                embeddings = await self._similarity_search_controller.embed_texts([item["question"] for item in batch])
+            except Exception as e:
+                self._logger.error(f"Embedding a batch of {len(batch)} questions failed: {e}")
+                stats.record(started_at, items=len(batch), failed=True)
+                self._claimed_keys.difference_update(image_key(item["image_url"]) for item in batch)
+                await self._release_slots(len(batch), failed=True)
+                continue
+            stats.record(started_at, items=len(batch))
+            for item, embedding in zip(batch, embeddings):
+                await embedded_queue.put((item, embedding))
+
+
+    async def _upsert(self, embedded_queue: asyncio.Queue) -> None:
+        stats = self._stats["upsert"]
+        while True:
+            batch = await self._collect_batch(embedded_queue, self._upsert_batch_size)
+            started_at = time.monotonic()
+            try:
+                await self._similarity_search_controller.upsert_questions(batch)
+            except Exception as e:
+                self._logger.error(f"Upserting a batch of {len(batch)} questions failed: {e}")
+                stats.record(started_at, items=len(batch), failed=True)
+                self._claimed_keys.difference_update(image_key(item["image_url"]) for item, _ in batch)
+                await self._release_slots(len(batch), failed=True)
+                continue
+            self._checkpoint.append([item for item, _ in batch])
+            stats.record(started_at, items=len(batch))
+            self._logger.info(f"Added {len(batch)} questions, {len(self._checkpoint)}/{self._target} in index.")
+            await self._release_slots(len(batch))
+
+
+    async def _collect_batch(self, queue: asyncio.Queue, batch_size: int) -> List:
+        batch = [await queue.get()]
+        deadline = time.monotonic() + BATCH_LINGER_SECONDS
+        while len(batch) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL_SECONDS)
+            self._log_stats()
+
+
+    def _log_stats(self) -> None:
+        for stats in self._stats.values():
+            self._logger.info(stats.summary())
+
+
+async def fill_index_with_questions(
     street_image_controller: StreetImageController,
     driving_exam_chat_controller: DrivingExamChatController,
     similarity_search_controller: SimilaritySearchController,
     count: int = 5000,
     city: str = "Paris",
+    checkpoint_path: str = DEFAULT_CHECKPOINT_PATH,
     logger: Optional[logging.Logger] = None
     ):
     logger = logger or logging.getLogger(__name__)
     logger.info("Starting to fill index with questions...")
-    for i in range(count):
-        try:
-            image_url = street_image_controller.get_street_image_url(city=city)
-            chat_id, results = driving_exam_chat_controller.generate_driving_questions_for_image(
-                image_url=image_url,
-                city=city
-            )
-            similarity_search_controller.add_question(
-                question_id=chat_id,
-                question=results["question"],
-                image_url=image_url
-            )
-            logger.info(f"Added question {i+1}/{count} to index.")
-        except Exception as e:
-            logger.error(f"Error processing image {i+1}: {e}")
+    builder = QuestionIndexBuilder(
+        street_image_controller=street_image_controller,
+        driving_exam_chat_controller=driving_exam_chat_controller,
+        similarity_search_controller=similarity_search_controller,
+        city=city,
+        checkpoint_path=checkpoint_path,
+        logger=logger,
+    )
+    return await builder.run(count)
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Fill the similarity search index with generated questions.")
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--city", default="Paris")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH)
+    args = parser.parse_args()
+
     logger = logging.getLogger("init_street_image_questions_index")
     logger.setLevel(logging.INFO)
     handler = logging.StreamHandler()
@@ -52,7 +379,7 @@ if __name__ == "__main__":
     mistral_api_key = os.getenv("MISTRAL_API_KEY")
     index_url = os.getenv("VECTOR_DB_ENDPOINT", None)
     index_token = os.getenv("VECTOR_DB_API_KEY", None)
-    
+
     role_arn = os.getenv("AWS_ROLE_ARN", None)
     if role_arn :
         aws_role_assumer = AWSRoleAssumer(role_arn, rotation_minutes=30)
@@ -65,7 +392,7 @@ if __name__ == "__main__":
     street_image_controller = StreetImageController(api_token=mapillary_token)
     driving_exam_chat_controller = DrivingExamChatController(
         mistral_client=mistral_client,
-        s3_client=s3_client,
+        chat_store=S3ChatStore(s3_client),
         logger=logger,
     )
     similarity_search_controller = SimilaritySearchController(
@@ -75,15 +402,13 @@ if __name__ == "__main__":
         logger=logger,
     )
 
-    fill_index_with_questions(
+    asyncio.run(fill_index_with_questions(
         street_image_controller=street_image_controller,
         driving_exam_chat_controller=driving_exam_chat_controller,
         similarity_search_controller=similarity_search_controller,
-        count=5000,  # Adjust the count as needed
-        city="Paris",  # Adjust the city as needed
+        count=args.count,
+        city=args.city,
+        checkpoint_path=args.checkpoint,
         logger=logger
-    )
+    ))
     logger.info("Index filling completed.")
-
-
-
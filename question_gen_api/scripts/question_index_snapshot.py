@@ -0,0 +1,45 @@
+from dotenv import load_dotenv, find_dotenv
+from mistralai import Mistral
+import argparse
+import asyncio
+import logging
+import os
+load_dotenv(find_dotenv(), override=True)
+
+from controllers.similarity_search_controller import SimilaritySearchController
+from shared.constants import UPSERT_BATCH_SIZE
+
+DEFAULT_SNAPSHOT_PATH = "question_index_snapshot"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Export the Upstash question index to a snapshot directory, or import a snapshot into it. "
+                    "The local vector index (VECTOR_INDEX_BACKEND=local) reads snapshots directly."
+    )
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("--snapshot", default=DEFAULT_SNAPSHOT_PATH)
+    parser.add_argument("--batch-size", type=int, default=UPSERT_BATCH_SIZE, help="Vectors per upsert when importing")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("question_index_snapshot")
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler()
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    similarity_search_controller = SimilaritySearchController(
+        index_url=os.getenv("VECTOR_DB_ENDPOINT", None),
+        api_key=os.getenv("VECTOR_DB_API_KEY", None),
+        mistral_client=Mistral(api_key=os.getenv("MISTRAL_API_KEY")),
+        logger=logger,
+    )
+
+    if args.action == "export":
+        count = asyncio.run(similarity_search_controller.export_snapshot(args.snapshot))
+        logger.info(f"Exported {count} vectors to {args.snapshot}")
+    else:
+        count = asyncio.run(similarity_search_controller.import_snapshot(args.snapshot, upsert_batch_size=args.batch_size))
+        logger.info(f"Imported {count} vectors from {args.snapshot}")
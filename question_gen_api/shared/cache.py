@@ -0,0 +1,100 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    In-process LRU cache with an optional per-entry time to live.
+    `on_evict(key, value)` is called for entries dropped by size or expiry, not for explicit pops.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl_seconds: Optional[float] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+        ) -> None:
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._on_evict = on_evict
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            self._evicted(key, value)
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self._ttl_seconds if self._ttl_seconds else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        self._expire()
+        while len(self._entries) > self._max_size:
+            evicted_key, (evicted_value, _) = self._entries.popitem(last=False)
+            self.evictions += 1
+            self._evicted(evicted_key, evicted_value)
+
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and (entry[1] is None or entry[1] > time.monotonic())
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+    def _expire(self) -> None:
+        # Best-effort sweep: least recently used entries usually expire first, so stop at the
+        # first live one to keep inserts O(1) amortized. get() still checks expiry exactly.
+        if not self._ttl_seconds:
+            return
+        now = time.monotonic()
+        while self._entries:
+            key, (value, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[key]
+            self.expirations += 1
+            self._evicted(key, value)
+
+
+    def _evicted(self, key: Hashable, value: Any) -> None:
+        if self._on_evict:
+            self._on_evict(key, value)
+
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
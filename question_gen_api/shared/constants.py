@@ -1,9 +1,73 @@
 from enum import Enum
 MISTRAL_BASE_URL = "https://api.mistral.ai/v1"
 MISTRAL_IMAGE_TEXT_MODEL = "pixtral-12b-2409"
+MISTRAL_EMBEDDING_MODEL = "mistral-embed"
 
 S3_BUCKET_NAME = "hackathon-ai-tech"
 
+# In-memory chat cache of the exam chat controller
+CHAT_CACHE_MAX_SIZE = 500
+CHAT_CACHE_TTL_SECONDS = 30 * 60
+
+# Chat history storage
+CHAT_S3_PREFIX = "chats/driving_exam/"
+CHAT_STORE_LOCAL_DIR = "chats"
+CHAT_STORE_SQLITE_PATH = "chats.sqlite3"
+CHAT_COMPACTION_SEGMENTS = 8     # Merge a chat's appended segments once it has this many
+CHAT_LOAD_ATTEMPTS = 3           # Listings retried when a segment was deleted by a concurrent compaction
+
+# Context sent with follow-up questions when the context window is enabled
+CHAT_CONTEXT_MAX_EXCHANGES = 6       # Most recent question/answer pairs kept besides the image turn
+CHAT_CONTEXT_TOKEN_BUDGET = 8000     # Estimated prompt tokens, system prompt and image included
+CHAT_CONTEXT_IMAGE_TOKENS = 3000     # Estimate for one Mapillary image (Pixtral uses one token per 16x16 patch)
+
+# Model calls per generated question before giving up on unparseable output
+QUESTION_PARSE_MAX_ATTEMPTS = 3
+
+# Cache of generated questions per (image, city, prompt version)
+QUESTION_CACHE_MAX_SIZE = 1000       # Entries of the in-process backend
+QUESTION_CACHE_TTL_SECONDS = 7 * 24 * 3600
+QUESTION_CACHE_VARIANTS = 1          # Different questions kept per key before serving from the cache
+QUESTION_CACHE_S3_PREFIX = "question_cache/"
+QUESTION_CACHE_SQLITE_PATH = "question_cache.sqlite3"
+
+class QuestionCacheBackend(Enum):
+    LOCAL = "local"
+    SQLITE = "sqlite"
+    S3 = "s3"
+
+class ChatStoreBackend(Enum):
+    S3 = "s3"
+    LOCAL = "local"
+    SQLITE = "sqlite"
+
+class ChatPersistenceMode(Enum):
+    WRITE_THROUGH = "write_through"   # Save the chat before answering
+    DEFERRED = "deferred"             # Save after the response is sent (flush_chat_history)
+
+# Upstream rate limits (sustained requests per second and burst size)
+MISTRAL_EMBEDDINGS_RATE_PER_SECOND = 1.0
+MISTRAL_EMBEDDINGS_BURST = 1
+UPSTASH_RATE_PER_SECOND = 10.0
+UPSTASH_BURST = 10
+
+# Question index batching
+EMBEDDING_BATCH_SIZE = 32     # Questions per mistral-embed request
+UPSERT_BATCH_SIZE = 100       # Vectors per Upstash upsert request
+INDEX_SCAN_BATCH_SIZE = 500   # Vectors per Upstash range request when exporting
+
+# Local vector index (approximate mode)
+LOCAL_INDEX_APPROXIMATE_MIN_ROWS = 5000   # Smaller indexes are always searched exactly
+LOCAL_INDEX_N_PROBE = 8                   # Clusters scored per query
+LOCAL_INDEX_KMEANS_ITERATIONS = 10
+
+class VectorIndexBackend(Enum):
+    UPSTASH = "upstash"
+    LOCAL = "local"
+
+# Embeddings of similarity search queries
+EMBEDDING_CACHE_MAX_SIZE = 2048
+
 class APIEndpoints(Enum):
     DOCS = "/api/v1/docs"
     REDOC = "/api/v1/redoc"
@@ -11,6 +75,7 @@ class APIEndpoints(Enum):
     LIVENESS = "/api/v1/healthy"
     EXAM_CHAT = "/api/v1/exam-chat"
     EXAM_CHAT_QUESTION = "/api/v1/exam-chat-question"
+    EXAM_CHAT_QUESTION_STREAM = "/api/v1/exam-chat-question/stream"
     STREET_IMAGE = "/api/v1/street-image"
     SIMILARITY_SEARCH = "/api/v1/similarity-search"
 
@@ -21,6 +86,51 @@ ExamAnswerMapping = {
     4: "D"
 }
 
+# Geocoding
+NOMINATIM_SEARCH_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_USER_AGENT = "roadbuddy/1.0"
+GEOCODE_CACHE_MAX_SIZE = 256
+GEOCODE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# Mapillary / Nominatim HTTP client
+MAPILLARY_IMAGES_URL = "https://graph.mapillary.com/images"
+MAPILLARY_MAP_FEATURES_URL = "https://graph.mapillary.com/map_features"
+MAPILLARY_GRAPH_URL = "https://graph.mapillary.com"
+HTTP_ENDPOINT_TIMEOUT_SECONDS = {
+    MAPILLARY_IMAGES_URL: 10,
+    MAPILLARY_MAP_FEATURES_URL: 8,
+    NOMINATIM_SEARCH_URL: 5,
+}
+HTTP_DEFAULT_TIMEOUT_SECONDS = 10
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 10
+HTTP_KEEPALIVE_EXPIRY_SECONDS = 30
+HTTP_MAX_RETRIES = 3
+HTTP_RETRY_BACKOFF_SECONDS = 0.5
+HTTP_RETRY_MAX_BACKOFF_SECONDS = 8
+HTTP_RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+MAPILLARY_MAX_PAGE_SIZE = 2000   # Largest `limit` accepted by the Graph API
+MAPILLARY_MAX_PAGES = 5          # Result pages followed through paging.next before giving up
+
+# Coordinates of the cities supported by the bot (City enum), never geocoded at runtime
+SUPPORTED_CITY_COORDINATES = {
+    "Paris": {"lat": 48.8534951, "lon": 2.3483915},
+}
+
+# Street image catalog
+STREET_IMAGE_CATALOG_PATH = "/tmp/street_image_catalog.sqlite3"
+CATALOG_IMAGES_PER_CITY = 300          # Filtered candidates kept per city
+CATALOG_REFRESH_SECONDS = 24 * 3600    # Rebuild a city once its catalog is older than this
+CATALOG_CHECK_INTERVAL_SECONDS = 600   # How often the background task looks for stale cities
+CATALOG_IMAGE_URL_EXPIRY_MARGIN_SECONDS = 3600   # Re-resolve a stored thumbnail URL once it expires within this margin
+CATALOG_IMAGE_URL_LIFETIME_SECONDS = 6 * 3600    # Assumed lifetime of signed URLs without an `oe` expiry
+
+# Pre-generated question pool
+QUESTION_POOL_TARGET_SIZE = 10          # Questions kept ready per city
+QUESTION_POOL_LOW_WATERMARK = 3         # Refill once a city has fewer ready questions
+QUESTION_POOL_REFILL_CONCURRENCY = 2    # Parallel Pixtral calls while refilling
+QUESTION_POOL_MAX_AGE_SECONDS = 6 * 3600  # Mapillary image URLs are signed and expire
+
 #OpenStreetMap constants
 PREFERRED_CAMERA_MAKES = [
     'GoPro', 'Canon', 'Nikon', 'Sony', 'Apple', 'Samsung', 
@@ -37,6 +147,7 @@ OLD_THRESHOLD_DAYS = 730   # "Old" images
 # SEARCH AREA PARAMETERS
 SEARCH_RADIUS_KM = 2.0    # Main search radius (in km)
 TRAFFIC_SIGN_RADIUS_KM = 1.0  # Radius for traffic sign search (more precise)
+TRAFFIC_SIGN_MAX_PAGES = 1    # map_features pages read before harvesting, each one delays the image search
 
 # LIMITS AND THRESHOLDS
 DEFAULT_STREET_IMAGE_LIMIT = 20        # Default number of images to download
@@ -56,6 +167,14 @@ EDUCATION_WEIGHT = 0.6    # Importance of educational content (signs, etc.)
 QUALITY_WEIGHT = 0.3      # Importance of camera quality
 RECENCY_WEIGHT = 0.1      # Importance of image recency
 
+# DETECTION SCORES
+NO_DETECTION_SCORE = 0.3          # Educational score of images without a detected traffic sign
+DETECTION_FAILED_SCORE = 0.5      # Educational score of every image when the detection query fails
+OTHER_CAMERA_QUALITY_SCORE = 0.5  # Quality score of cameras not in PREFERRED_CAMERA_MAKES
+
+# IMAGE FILTERS
+IMAGE_BLACKLIST_RELOAD_SECONDS = 60   # How often the blacklist file is checked for changes
+
 # RECENCY SCORES
 RECENT_SCORE = 1.0        # Score for recent images
 MEDIUM_RECENT_SCORE = 0.8 # Score for medium recent images
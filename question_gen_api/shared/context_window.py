@@ -0,0 +1,96 @@
+import logging
+from typing import Dict, List, Optional
+
+from shared.constants import (
+    CHAT_CONTEXT_MAX_EXCHANGES,
+    CHAT_CONTEXT_TOKEN_BUDGET,
+    CHAT_CONTEXT_IMAGE_TOKENS,
+)
+
+# Rough tokens per character for English text with the Mistral tokenizer, plus per-message overhead
+_CHARS_PER_TOKEN = 4
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(message: Dict) -> int:
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return _MESSAGE_OVERHEAD_TOKENS + len(content) // _CHARS_PER_TOKEN
+    tokens = _MESSAGE_OVERHEAD_TOKENS
+    for part in content:
+        if part.get("type") == "image_url":
+            tokens += CHAT_CONTEXT_IMAGE_TOKENS
+        else:
+            tokens += len(part.get("text") or "") // _CHARS_PER_TOKEN
+    return tokens
+
+
+def _has_image(message: Dict) -> bool:
+    content = message.get("content")
+    return isinstance(content, list) and any(part.get("type") == "image_url" for part in content)
+
+
+class ContextWindow:
+    """
+    Picks the chat messages sent to the model for a follow-up question: the latest
+    image turn (the image and the generated question), then the most recent
+    exchanges, at most `max_exchanges` of them and only as many as fit in
+    `token_budget`. Older turns are dropped.
+    """
+
+    def __init__(
+        self,
+        max_exchanges: int = CHAT_CONTEXT_MAX_EXCHANGES,
+        token_budget: int = CHAT_CONTEXT_TOKEN_BUDGET,
+        logger: Optional[logging.Logger] = None,
+        ) -> None:
+        self._max_exchanges = max_exchanges
+        self._token_budget = token_budget
+        self._logger = logger or logging.getLogger(__name__)
+
+
+    def select(self, messages: List[Dict], system_prompt: str = "") -> List[Dict]:
+        """`messages` ends with the pending user question, which is always kept."""
+        if not messages:
+            return []
+        image_index = next((i for i in range(len(messages) - 1, -1, -1) if _has_image(messages[i])), None)
+        anchor_end = 0
+        if image_index is not None:
+            anchor_end = image_index + 1
+            if anchor_end < len(messages) - 1 and messages[anchor_end]["role"] == "assistant":
+                anchor_end += 1
+        anchor = messages[image_index:anchor_end] if image_index is not None else []
+        pending = messages[-1:]
+        if anchor_end >= len(messages):
+            anchor, pending = messages[image_index:], []
+
+        used = (
+            estimate_tokens({"content": system_prompt})
+            + sum(estimate_tokens(message) for message in anchor)
+            + sum(estimate_tokens(message) for message in pending)
+        )
+        kept: List[List[Dict]] = []
+        for exchange in reversed(self._exchanges(messages[anchor_end:len(messages) - len(pending)])):
+            if len(kept) >= self._max_exchanges:
+                break
+            cost = sum(estimate_tokens(message) for message in exchange)
+            if used + cost > self._token_budget:
+                break
+            used += cost
+            kept.append(exchange)
+
+        selected = anchor + [message for exchange in reversed(kept) for message in exchange] + pending
+        if len(selected) < len(messages):
+            self._logger.debug(f"Context window kept {len(selected)} of {len(messages)} messages (~{used} tokens)")
+        return selected
+
+
+    @staticmethod
+    def _exchanges(messages: List[Dict]) -> List[List[Dict]]:
+        # An exchange starts at each user message and runs until the next one
+        exchanges: List[List[Dict]] = []
+        for message in messages:
+            if message["role"] == "user" or not exchanges:
+                exchanges.append([])
+            exchanges[-1].append(message)
+        return exchanges
@@ -0,0 +1,154 @@
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from shared.constants import IMAGE_BLACKLIST_RELOAD_SECONDS
+
+DEFAULT_BLACKLIST_PATH = str(Path(__file__).resolve().parent / "image_blacklist.txt")
+
+# Characters of Mapillary image identifiers; a URL is split into runs of them
+_IDENTIFIER_RUN = re.compile(r"[A-Za-z0-9_-]+")
+# Model names that are clearly 360° cameras
+SPHERICAL_MODEL_MARKERS = ("360", "theta", "insta360")
+
+
+def _compile_any(words: Iterable[str]) -> Optional[re.Pattern]:
+    """One case-insensitive pattern matching any of the words as a substring."""
+    words = [word for word in words if word]
+    if not words:
+        return None
+    return re.compile("|".join(re.escape(word) for word in sorted(words, key=len, reverse=True)), re.IGNORECASE)
+
+
+class ImageBlacklist:
+    """
+    Image identifiers that must never be served, matched as substrings of image URLs.
+    Identifiers are grouped by length in hash sets, so a URL costs a few set lookups
+    per identifier length, however long the blacklist grows. The file (one identifier
+    per line, `#` comments) is re-read when it changes, checked at most every
+    `reload_seconds`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_BLACKLIST_PATH,
+        identifiers: Iterable[str] = (),
+        reload_seconds: float = IMAGE_BLACKLIST_RELOAD_SECONDS,
+        logger: Optional[logging.Logger] = None,
+        ) -> None:
+        self._path = path
+        self._extra = [identifier.strip() for identifier in identifiers if identifier.strip()]
+        self._reload_seconds = reload_seconds
+        self._logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._by_length: Dict[int, Set[str]] = {}
+        self._other: List[str] = []
+        self._size = 0
+        self.reload_if_changed(force=True)
+
+
+    def __len__(self) -> int:
+        return self._size
+
+
+    def __contains__(self, url: str) -> bool:
+        self._maybe_reload()
+        by_length, other = self._by_length, self._other
+        if by_length:
+            for run in _IDENTIFIER_RUN.findall(url):
+                for length, identifiers in by_length.items():
+                    if length > len(run):
+                        continue
+                    if length == len(run):
+                        if run in identifiers:
+                            return True
+                    elif any(run[i:i + length] in identifiers for i in range(len(run) - length + 1)):
+                        return True
+        return any(identifier in url for identifier in other)
+
+
+    def reload_if_changed(self, force: bool = False) -> bool:
+        """Re-reads the blacklist file if its modification time changed. Returns whether it was reloaded."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            mtime = self._file_mtime()
+            if not force and mtime == self._mtime:
+                return False
+            identifiers = list(self._extra)
+            if mtime is not None:
+                try:
+                    with open(self._path, "r", encoding="utf-8") as f:
+                        identifiers.extend(line.split("#", 1)[0].strip() for line in f)
+                except OSError as e:
+                    self._logger.warning(f"Could not read image blacklist {self._path}: {e}")
+                    return False
+            self._compile(identifiers)
+            self._mtime = mtime
+            self._logger.info(f"Loaded {self._size} blacklisted image identifiers")
+            return True
+
+
+    def _maybe_reload(self) -> None:
+        if self._path and time.monotonic() - self._checked_at >= self._reload_seconds:
+            self.reload_if_changed()
+
+
+    def _compile(self, identifiers: List[str]) -> None:
+        by_length: Dict[int, Set[str]] = {}
+        other = []
+        for identifier in set(filter(None, identifiers)):
+            if _IDENTIFIER_RUN.fullmatch(identifier):
+                by_length.setdefault(len(identifier), set()).add(identifier)
+            else:
+                # Not a plain identifier, falls back to a substring scan
+                other.append(identifier)
+        # Swapped in whole so lookups never see a half-built blacklist
+        self._by_length, self._other = by_length, other
+        self._size = sum(len(group) for group in by_length.values()) + len(other)
+
+
+    def _file_mtime(self) -> Optional[float]:
+        if not self._path:
+            return None
+        try:
+            return os.stat(self._path).st_mtime
+        except OSError:
+            return None
+
+
+class ImageFilter:
+    """Blacklist and camera checks of the image pipelines, each compiled once."""
+
+    def __init__(
+        self,
+        excluded_camera_types: Iterable[str] = (),
+        excluded_camera_models: Iterable[str] = (),
+        blacklist: Optional[ImageBlacklist] = None,
+        ) -> None:
+        self.blacklist = blacklist if blacklist is not None else ImageBlacklist()
+        self._camera_types = _compile_any(excluded_camera_types)
+        self._camera_models = _compile_any(excluded_camera_models)
+        self._spherical_markers = _compile_any(SPHERICAL_MODEL_MARKERS)
+
+
+    def is_blacklisted(self, url: str) -> bool:
+        return url in self.blacklist
+
+
+    def is_excluded_camera_type(self, camera_type: str) -> bool:
+        return bool(self._camera_types and self._camera_types.search(camera_type))
+
+
+    def is_excluded_camera_model(self, model: str) -> bool:
+        return bool(self._camera_models and self._camera_models.search(model))
+
+
+    def is_spherical_camera_model(self, model: str) -> bool:
+        """An excluded model that is clearly a 360° camera."""
+        return self.is_excluded_camera_model(model) and bool(self._spherical_markers.search(model))
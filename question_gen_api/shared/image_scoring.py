@@ -0,0 +1,233 @@
+import random
+import time
+from typing import Dict, List, Optional, Sequence, Set
+
+import numpy as np
+
+from shared.constants import (
+    PREFERRED_CAMERA_MAKES,
+    MAX_TOP_CANDIDATES,
+    EDUCATION_WEIGHT,
+    QUALITY_WEIGHT,
+    RECENCY_WEIGHT,
+    RECENT_THRESHOLD_DAYS,
+    MEDIUM_RECENT_DAYS,
+    OLD_THRESHOLD_DAYS,
+    RECENT_SCORE,
+    MEDIUM_RECENT_SCORE,
+    OLD_SCORE,
+    VERY_OLD_SCORE,
+    NO_DETECTION_SCORE,
+    DETECTION_FAILED_SCORE,
+    OTHER_CAMERA_QUALITY_SCORE,
+)
+
+# Columns of ImageCandidates.features, in the order of ScoringProfile.weights
+FEATURES = ("educational", "road_infrastructure", "vehicle_content", "vehicle_likelihood", "road_validated", "quality")
+# Features set from Mapillary map_features detections
+DETECTION_FEATURES = FEATURES[:3]
+
+DEFAULT_VEHICLE_LIKELIHOOD = 0.5
+SECONDS_PER_DAY = 86400
+
+
+class ScoringProfile:
+    """
+    Weights, recency thresholds and fallback scores of one image-selection pipeline.
+    Features without a weight do not contribute to the score.
+    """
+
+    def __init__(
+        self,
+        education_weight: float,
+        quality_weight: float,
+        recency_weight: float,
+        road_content_weight: float = 0.0,
+        vehicle_content_weight: float = 0.0,
+        vehicle_perspective_weight: float = 0.0,
+        road_validation_weight: float = 0.0,
+        recency_days: Sequence[int] = (RECENT_THRESHOLD_DAYS, MEDIUM_RECENT_DAYS, OLD_THRESHOLD_DAYS),
+        recency_scores: Sequence[float] = (RECENT_SCORE, MEDIUM_RECENT_SCORE, OLD_SCORE, VERY_OLD_SCORE),
+        preferred_camera_makes: Sequence[str] = PREFERRED_CAMERA_MAKES,
+        preferred_camera_quality: float = 1.0,
+        other_camera_quality: float = OTHER_CAMERA_QUALITY_SCORE,
+        no_detection_score: float = NO_DETECTION_SCORE,
+        detection_failed_score: float = DETECTION_FAILED_SCORE,
+        max_top_candidates: int = MAX_TOP_CANDIDATES,
+        ) -> None:
+        if len(recency_scores) != len(recency_days) + 1:
+            raise ValueError("recency_scores needs one score more than recency_days")
+        self.weights = np.array([
+            education_weight,
+            road_content_weight,
+            vehicle_content_weight,
+            vehicle_perspective_weight,
+            road_validation_weight,
+            quality_weight,
+        ])
+        self.recency_weight = recency_weight
+        self.recency_days = np.array(recency_days, dtype=np.float64)
+        self.recency_scores = np.array(recency_scores, dtype=np.float64)
+        self.preferred_camera_makes = tuple(preferred_camera_makes)
+        self.preferred_camera_quality = preferred_camera_quality
+        self.other_camera_quality = other_camera_quality
+        self.no_detection_score = no_detection_score
+        self.detection_failed_score = detection_failed_score
+        self.max_top_candidates = max_top_candidates
+
+
+    def recency(self, captured_at: np.ndarray, now: float) -> np.ndarray:
+        """Scores of capture times in milliseconds since epoch, 0 where unknown (0 or NaN)."""
+        days_ago = np.floor((now - captured_at / 1000) / SECONDS_PER_DAY)
+        # Bucket i holds the ages in [recency_days[i-1], recency_days[i])
+        scores = self.recency_scores[np.searchsorted(self.recency_days, np.nan_to_num(days_ago), side="right")]
+        return np.where(np.isfinite(captured_at) & (captured_at != 0), scores, 0.0)
+
+
+    def is_preferred_camera(self, make: str) -> bool:
+        return any(preferred in make for preferred in self.preferred_camera_makes)
+
+
+# Profile of StreetImageController, from shared/constants.py
+STREET_IMAGE_SCORING_PROFILE = ScoringProfile(
+    education_weight=EDUCATION_WEIGHT,
+    quality_weight=QUALITY_WEIGHT,
+    recency_weight=RECENCY_WEIGHT,
+)
+
+
+class ImageCandidates:
+    """
+    Columnar view of Mapillary image dicts: ids, capture times and one feature
+    column per scoring input. Row i describes images[i]; the dicts are not modified.
+    """
+
+    def __init__(self, images: List[Dict], ids: np.ndarray, captured_at: np.ndarray, features: np.ndarray, detections: np.ndarray) -> None:
+        self.images = images
+        self.ids = ids
+        self.captured_at = captured_at
+        self.features = features
+        self.detections = detections
+
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+
+    def column(self, feature: str) -> np.ndarray:
+        return self.features[:, FEATURES.index(feature)]
+
+
+    def detected(self, feature: str) -> np.ndarray:
+        """Boolean mask of the rows in which the detection feature was found."""
+        return self.detections[:, DETECTION_FEATURES.index(feature)]
+
+
+    def take(self, rows) -> "ImageCandidates":
+        rows = np.asarray(rows, dtype=np.intp)
+        return ImageCandidates(
+            images=[self.images[i] for i in rows],
+            ids=self.ids[rows],
+            captured_at=self.captured_at[rows],
+            features=self.features[rows],
+            detections=self.detections[rows],
+        )
+
+
+class ImageScoringEngine:
+    """
+    Scoring and selection shared by the street image pipelines, which only
+    differ by their ScoringProfile.
+    """
+
+    def __init__(self, profile: ScoringProfile = STREET_IMAGE_SCORING_PROFILE) -> None:
+        self.profile = profile
+
+
+    def candidates(self, images: List[Dict]) -> ImageCandidates:
+        """Columns of the images, before detections: detection features start at 0."""
+        profile = self.profile
+        features = np.zeros((len(images), len(FEATURES)))
+        features[:, FEATURES.index("vehicle_likelihood")] = [
+            img.get("vehicle_likelihood", DEFAULT_VEHICLE_LIKELIHOOD) for img in images
+        ]
+        features[:, FEATURES.index("road_validated")] = [
+            1.0 if img.get("road_validated") else 0.0 for img in images
+        ]
+        features[:, FEATURES.index("quality")] = [
+            profile.preferred_camera_quality if profile.is_preferred_camera((img.get("make") or "").strip())
+            else profile.other_camera_quality
+            for img in images
+        ]
+        return ImageCandidates(
+            images=list(images),
+            ids=np.array([str(img.get("id")) for img in images], dtype=str),
+            captured_at=np.array([_timestamp(img.get("captured_at")) for img in images], dtype=np.float64),
+            features=features,
+            detections=np.zeros((len(images), len(DETECTION_FEATURES)), dtype=bool),
+        )
+
+
+    def apply_detections(self, candidates: ImageCandidates, detected_ids: Optional[Dict[str, Set]]) -> None:
+        """
+        Sets the detection features from image ids per detection feature. Rows without any
+        detection get the profile's no_detection_score; `None` means the detection queries
+        failed and every row gets detection_failed_score.
+        """
+        scores = candidates.features[:, :len(DETECTION_FEATURES)]
+        if detected_ids is None:
+            candidates.detections[:] = False
+            scores[:] = self.profile.detection_failed_score
+            return
+        for j, feature in enumerate(DETECTION_FEATURES):
+            ids = detected_ids.get(feature)
+            candidates.detections[:, j] = np.isin(candidates.ids, [str(i) for i in ids]) if ids else False
+        scores[:] = candidates.detections
+        scores[~candidates.detections.any(axis=1)] = self.profile.no_detection_score
+
+
+    def scores(self, candidates: ImageCandidates, now: Optional[float] = None) -> np.ndarray:
+        """Weighted score of every candidate."""
+        return self.score_batch(candidates.captured_at, candidates.features, now)
+
+
+    def score_batch(self, captured_at: np.ndarray, features: np.ndarray, now: Optional[float] = None) -> np.ndarray:
+        """
+        Weighted scores from a captured_at column (milliseconds since epoch) and an
+        (n, len(FEATURES)) feature matrix. The whole batch is scored against one `now`.
+        """
+        now = time.time() if now is None else now
+        captured_at = np.asarray(captured_at, dtype=np.float64)
+        return np.asarray(features, dtype=np.float64) @ self.profile.weights + self.profile.recency(captured_at, now) * self.profile.recency_weight
+
+
+    def select(self, candidates: ImageCandidates, now: Optional[float] = None) -> Optional[Dict]:
+        """Random pick among the best-scored candidates, None when there are none."""
+        if not len(candidates):
+            return None
+        best = top_k(self.scores(candidates, now), self.profile.max_top_candidates)
+        return candidates.images[random.choice(best)]
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Rows of the k highest scores, best first, in O(n) rather than a full sort.
+    Ties are broken by row order, as a stable descending sort would.
+    """
+    n = len(scores)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:k - len(above)]
+    rows = np.concatenate([above, ties])
+    return rows[np.argsort(-scores[rows], kind="stable")]
+
+
+def _timestamp(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
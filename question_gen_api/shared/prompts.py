@@ -1,7 +1,9 @@
+# Bump whenever the question prompts change, cached questions of older versions are then ignored
+QUESTION_PROMPT_VERSION = 2
 DRIVING_EXAM_CHAT_SYSTEM_PROMPT = """You are a teacher for a driving school student learning the street rules of %s.
     You will be given an image of a street in the city, and you will generate a driving test question for a student learning the street rules of the city.
     The question should be in English and the answers should be in English. Format the answer as following 
-    JSON: {"question": "<question>", "answers": ["<answer1>", "<answer2>", "<answer3>", "<answer4>"], "explanation: <explanation for choice>, "correct_answer": "<correct_answer_number>"}. 
+    JSON: {"question": "<question>", "answers": ["<answer1>", "<answer2>", "<answer3>", "<answer4>"], "explanation": "<explanation for choice>", "correct_answer": "<correct_answer_number>"}. 
     The correct answer should be one of the answers provided."""
 DRIVING_EXAM_CHAT_SYSTEM_PROMPT_FOLLOW_UP = """You are a teacher for a driving school student learning the street rules.
     Can you answer the following follow-up question based on the image and previous question you as assistant generated?
@@ -0,0 +1,84 @@
+import json
+from typing import Any, Dict, List
+
+_decoder = json.JSONDecoder()
+_ANSWER_LETTERS = "ABCD"
+
+
+class QuestionParseError(ValueError):
+    """The model output is not a usable exam question."""
+
+
+class QuestionGenerationError(RuntimeError):
+    """The model gave no usable exam question within the allowed attempts."""
+
+
+def message_text(content: Any) -> str:
+    """Text of a chat completion message, whose content is either a string or a list of chunks."""
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "".join(getattr(chunk, "text", "") or "" for chunk in content)
+
+
+def parse_question(content: str) -> Dict:
+    """
+    Parses the JSON question generated by the model into
+    {question, answers, explanation, correct_answer}, correct_answer being the
+    1-based number of the right answer. Raises QuestionParseError if the output
+    is not valid JSON or misses a question or answers.
+    """
+    data = _decode_object(content)
+    question = data.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise QuestionParseError("Missing question")
+    answers = data.get("answers")
+    if not isinstance(answers, list) or not 2 <= len(answers) <= len(_ANSWER_LETTERS):
+        raise QuestionParseError(f"Expected 2 to {len(_ANSWER_LETTERS)} answers")
+    answers = [str(answer) for answer in answers]
+    explanation = data.get("explanation", "")
+    return {
+        "question": question.strip(),
+        "answers": answers,
+        "explanation": explanation if isinstance(explanation, str) else json.dumps(explanation),
+        "correct_answer": _correct_answer_number(data.get("correct_answer"), answers),
+    }
+
+
+def _decode_object(content: str) -> Dict:
+    # JSON mode returns a bare object; without it the model may still wrap it in prose or a code fence
+    content = content.strip()
+    start = content.find("{")
+    while start != -1:
+        try:
+            data, _ = _decoder.raw_decode(content, start)
+        except json.JSONDecodeError:
+            start = content.find("{", start + 1)
+            continue
+        if isinstance(data, dict):
+            return data
+        start = content.find("{", start + 1)
+    raise QuestionParseError("No JSON object in model output")
+
+
+def _correct_answer_number(value: Any, answers: List[str]) -> int:
+    if isinstance(value, bool):
+        raise QuestionParseError(f"Invalid correct answer {value!r}")
+    if isinstance(value, int):
+        number = value
+    elif isinstance(value, str):
+        value = value.strip()
+        if value.isdigit():
+            number = int(value)
+        elif len(value) == 1 and value.upper() in _ANSWER_LETTERS:
+            number = _ANSWER_LETTERS.index(value.upper()) + 1
+        elif value in answers:
+            number = answers.index(value) + 1
+        else:
+            raise QuestionParseError(f"Invalid correct answer {value!r}")
+    else:
+        raise QuestionParseError(f"Invalid correct answer {value!r}")
+    if not 1 <= number <= len(answers):
+        raise QuestionParseError(f"Correct answer {number} out of range for {len(answers)} answers")
+    return number
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+
+class TokenBucketRateLimiter:
+    """Async token bucket: callers only wait once the burst capacity is used up."""
+
+    def __init__(self, rate_per_second: float, capacity: Optional[float] = None, name: str = "") -> None:
+        if rate_per_second <= 0:
+            raise ValueError("rate_per_second must be positive")
+        self.name = name
+        self._rate = rate_per_second
+        self._capacity = capacity if capacity is not None else max(1.0, rate_per_second)
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+        self._acquired = 0
+        self._waited = 0
+        self._total_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """Takes `tokens` from the bucket, sleeping only as long as needed. Returns the time waited."""
+        if tokens > self._capacity:
+            raise ValueError(f"Cannot acquire {tokens} tokens from a bucket of capacity {self._capacity}")
+
+        started_at = time.monotonic()
+        queued = self._lock.locked()
+        # The lock keeps waiters in FIFO order so a burst cannot starve earlier callers
+        async with self._lock:
+            self._refill()
+            throttled = self._tokens < tokens
+            if throttled:
+                await asyncio.sleep((tokens - self._tokens) / self._rate)
+                self._refill()
+            self._tokens -= tokens
+            wait_seconds = time.monotonic() - started_at if (queued or throttled) else 0.0
+            self._record(wait_seconds)
+            return wait_seconds
+
+
+    def stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "rate_per_second": self._rate,
+            "capacity": self._capacity,
+            "acquired": self._acquired,
+            "waited": self._waited,
+            "total_wait_seconds": round(self._total_wait_seconds, 4),
+            "max_wait_seconds": round(self._max_wait_seconds, 4),
+        }
+
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+
+    def _record(self, wait_seconds: float) -> None:
+        self._acquired += 1
+        if wait_seconds > 0:
+            self._waited += 1
+            self._total_wait_seconds += wait_seconds
+            self._max_wait_seconds = max(self._max_wait_seconds, wait_seconds)
@@ -0,0 +1,75 @@
+import asyncio
+import io
+import json
+
+from botocore.exceptions import ClientError
+
+from clients.chat_store import S3ChatStore
+
+BUCKET = "bucket"
+PREFIX = "chats/"
+
+
+class FakeS3Client:
+    """In-memory stand-in for AWSS3Client, raising NoSuchKey like S3 does."""
+
+    def __init__(self) -> None:
+        self.objects = {}
+
+    async def list_folder_objects_async(self, bucket_name, folder_path):
+        return sorted(key for key in self.objects if key.startswith(folder_path))
+
+    async def read_file_async(self, bucket_name, object_key):
+        if object_key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return io.BytesIO(self.objects[object_key])
+
+    async def write_file_async(self, bucket_name, object_key, byte_reader):
+        self.objects[object_key] = byte_reader
+
+    async def delete_files_async(self, bucket_name, object_keys):
+        for key in object_keys:
+            self.objects.pop(key, None)
+
+
+def _message(i):
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"}
+
+
+def _legacy_chat(s3, chat_id, count):
+    # Chats saved before segments were introduced: one document without first_index
+    document = {"created_at": "2025-01-01T00:00:00", "messages": [_message(i) for i in range(count)]}
+    s3.objects[f"{PREFIX}{chat_id}.json"] = json.dumps(document).encode("utf-8")
+
+
+def test_load_legacy_chat_after_append():
+    s3 = FakeS3Client()
+    store = S3ChatStore(s3, bucket_name=BUCKET, prefix=PREFIX)
+    _legacy_chat(s3, "chat", 2)
+
+    asyncio.run(store.append("chat", "2025-01-01T00:00:00", 2, [_message(2), _message(3)]))
+    history = asyncio.run(store.load("chat"))
+
+    assert history.messages == [_message(i) for i in range(4)]
+    assert history.created_at == "2025-01-01T00:00:00"
+
+
+def test_compact_merges_legacy_chat():
+    s3 = FakeS3Client()
+    store = S3ChatStore(s3, bucket_name=BUCKET, prefix=PREFIX)
+    _legacy_chat(s3, "chat", 2)
+    asyncio.run(store.append("chat", "2025-01-01T00:00:00", 2, [_message(2), _message(3)]))
+    asyncio.run(store.append("chat", "2025-01-01T00:00:00", 4, [_message(4), _message(5)]))
+
+    asyncio.run(store.compact("chat"))
+    history = asyncio.run(store.load("chat"))
+
+    assert list(s3.objects) == [f"{PREFIX}chat/000000.json"]
+    assert history.segment_count == 1
+    assert history.messages == [_message(i) for i in range(6)]
+
+
+def test_load_missing_chat():
+    store = S3ChatStore(FakeS3Client(), bucket_name=BUCKET, prefix=PREFIX)
+
+    assert asyncio.run(store.load("missing")) is None